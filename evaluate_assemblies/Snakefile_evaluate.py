@@ -1,72 +1,129 @@
-import pandas as pd
 import shlex
 import subprocess
 from pathlib import Path
-from Bio import SeqIO
 import re
 from os import path
-import jinja2
-from collections import OrderedDict
-import numpy as np
 import os
+import sys
 
 configfile: "config.yaml"
 
-samples = pd.read_table(config["samples"]).set_index("sample", drop=False)
+# helpers shared by all the pipelines of the repository
+SHARED_SCRIPTS = os.path.join(workflow.basedir, "..", "scripts")
+# content-addressed cache (aligner indexes, ...) shared across samples, runs and pipelines
+CACHE_DIR = config.get("cache_dir", "~/.cache/snakemake_pipelines")
+CACHE_MAX_SIZE = config.get("cache_max_size", "50G")
+# the benchmark files of every run are collected in a database shared by the pipelines
+BENCHMARK_DB = config.get("benchmark_db", "~/.cache/snakemake_pipelines/benchmarks.sqlite")
+# optional: CPU, memory and I/O of every job are sampled every telemetry_interval seconds and
+# exported as a Chrome trace timeline to evaluate_assembly/telemetry/trace.json (scripts/telemetry.py)
+TELEMETRY_INTERVAL = config.get("telemetry_interval")
+TELEMETRY_DIR = "evaluate_assembly/telemetry" if TELEMETRY_INTERVAL else None
+
+sys.path.insert(0, SHARED_SCRIPTS)
+import resource_model
+import subsample_reads
+import telemetry
+import reports
+import sample_table
+
+# samples.tsv is read without pandas, the Snakefile is parsed again for every job
+samples = sample_table.read_samples(config["samples"])
+
+# memory, threads and disk of each job are estimated from the assembly and the reads (scripts/resource_model.py),
+# no job asks for more than `memory` (optional) or `threads`
+READS = [config["fq1"], config["fq2"]]
+MAX_MEM_MB = resource_model.parse_memory_mb(config.get("memory"))
+
+def tool_threads(tool, threads=config["threads"]):
+        """``threads`` of a rule: what ``tool`` keeps busy on the assembly of each job and the reads, at most ``threads``."""
+        def job_threads(wildcards):
+                genome = resource_model.data_size([get_genome(wildcards)])
+                return resource_model.threads(tool, genome, resource_model.data_size(READS), threads)
+        return job_threads
+
+def sort_setting(threads):
+        """(samtools sort -m, MB used by the sort) of a job with ``threads``: `sort_memory_per_thread` when it is set,
+        otherwise derived from the reads size."""
+        sort_memory = config.get("sort_memory_per_thread")
+        return resource_model.sort_setting(resource_model.data_size(READS), threads, MAX_MEM_MB, sort_memory)
+
+# optional: the reads are subsampled once to target_coverage x genome_size and every assembly is evaluated with the subset
+TARGET_COVERAGE = config.get("target_coverage")
+if TARGET_COVERAGE:
+        MAPPED_READS = ['evaluate_assembly/subsampled_reads/reads_{}.{}'.format(number, subsample_reads.subset_suffix(reads))
+                        for number, reads in enumerate(READS, 1)]
+else:
+        MAPPED_READS = READS
+
+# the BUSCO groups of the lineage are split in this many shards, each one run as a separate job
+BUSCO_SHARDS = list(range(int(config.get("busco_shards", 1))))
+# the threads are shared by the shards, so they all run side by side on one node
+BUSCO_THREADS = tool_threads("busco", max(1, config["threads"] // len(BUSCO_SHARDS)))
+
+# ALE, REAPR and the dockerized BUSCO are executed in one long-lived container per image
+CONTAINER_BACKEND = config.get("container_backend", "docker")
+CONTAINER_POOL = "python {} --backend {} run --max-jobs {} --idle-timeout {}{}".format(
+        os.path.join(SHARED_SCRIPTS, "container_pool.py"), CONTAINER_BACKEND, config.get("container_max_jobs", 4),
+        config.get("container_idle_timeout", 600), "" if config.get("container_pool", True) else " --no-pool")
+
+# columns of the preview report, which only waits for the contig statistics
+PREVIEW_COLUMNS = ['genomesize', 'contigs', 'largest', 'n50', 'l50', 'ng50', 'lg50', 'gc', 'n_per_100kbp', 'n_gaps', 'ale', 'reapr_total_errors', 'pctcomplete']
+# metrics shown in the report, in the column order of results.csv/results.xlsx
+REPORT_COLUMNS = ['ale', 'reapr_total_errors', 'reapr_fcd', 'reapr_low', 'genomesize', 'contigs', 'n50', 'largest', 'pctcomplete', 'pctsingle', 'pctduplicated', 'pctfragmented', 'pctmissing', 'ncomplete', 'nsingle', 'nduplicated', 'nfragmented', 'nmissing']
 
 def get_genome(wildcards):
-        return samples.loc[wildcards.sample, "assembly"]
+        return samples.value(wildcards.sample, "assembly")
 
 def get_genome_prefix(wildcards):
-        gen = samples.loc[wildcards.sample, "assembly"]
+        gen = samples.value(wildcards.sample, "assembly")
         return ''.join(gen.split('.')[:-1])
 
-def get_all_genomes(wildcards):
-  return ' '.join(samples["assembly"].values)
-
 def get_all_names(wildcards):
-  return ','.join(samples["sample"].values)
-
-def parse_busco(out_short_summary):
-    dict_busco = {}
-    with open(out_short_summary, 'r') as infbusco:
-        for idxline, line in enumerate(infbusco.readlines()):
-            # line = line.strip("\n")
-            if line.startswith("#"):
-                match_db_obj = re.match(r'.+\(.+number of species\:\s(\d+),\snumber of BUSCOs\:\s(\d+)\)', line)
-                #if match_db_obj:
-                #    print(match_db_obj.group(1), match_db_obj.group(2))
-            else:
-                match_summary_obj = re.match(r'\s+C\:(\d+.\d+)\%\[S\:(\d+.\d)\%,D\:(\d+.\d+)\%\],F\:(\d+.\d+)\%,M:(\d+.\d+)%,n:\d+', line)
-                if match_summary_obj:
-                    dict_busco['pctcomplete'] = match_summary_obj.group(1)
-                    dict_busco['pctsingle'] = match_summary_obj.group(2)
-                    dict_busco['pctduplicated'] = match_summary_obj.group(3)
-                    dict_busco['pctfragmented'] = match_summary_obj.group(4)
-                    dict_busco['pctmissing'] = match_summary_obj.group(5)
-                #    print(idxline)
-                elif idxline == 9:
-                    match_n = re.match(r'\s+(\d+)\s+.+', line)
-                    n = match_n.group(1)
-                    dict_busco['ncomplete'] = n
-                elif idxline == 10:
-                    match_n = re.match(r'\s+(\d+)\s+.+', line)
-                    n = match_n.group(1)
-                    dict_busco['nsingle'] = n
-                elif idxline == 11:
-                    match_n = re.match(r'\s+(\d+)\s+.+', line)
-                    n = match_n.group(1)
-                    dict_busco['nduplicated'] = n
-                elif idxline == 12:
-                    match_n = re.match(r'\s+(\d+)\s+.+', line)
-                    n = match_n.group(1)
-                    dict_busco['nfragmented'] = n
-                elif idxline == 13:
-                    match_n = re.match(r'\s+(\d+)\s+.+', line)
-                    n = match_n.group(1)
-                    dict_busco['nmissing'] = n
-    return(dict_busco)
-
+  return ','.join(samples["sample"])
+
+def job_resource(tool, name, extra_mb=0):
+        """Estimated mem_mb or disk_mb of running ``tool`` with the threads of a job on its assembly, larger at every restart.
+
+        ``extra_mb`` may be a function of the threads (e.g. the memory of samtools sort)."""
+        def resource(wildcards, threads, attempt):
+                genome = resource_model.data_size([get_genome(wildcards)])
+                extra = extra_mb(threads) if callable(extra_mb) else extra_mb
+                return getattr(resource_model.estimate(tool, genome, resource_model.data_size(READS), threads, attempt,
+                                                       MAX_MEM_MB, extra), name)
+        return resource
+
+def threads_record(benchmark):
+        """File next to ``benchmark`` where the job writes its number of threads, stored by benchmarks.py collect."""
+        return benchmark + ".threads"
+
+def pool_run(image, mount="/dir"):
+        """Prefix that runs a command in the worker container of ``image``."""
+        image_file = config.get("container_images", {}).get(image)
+        return "{} --image {} --mount {}{}".format(CONTAINER_POOL, image, mount, " --image-file {}".format(image_file) if image_file else "")
+
+onstart:
+        if TELEMETRY_DIR:
+                telemetry.start_monitor(TELEMETRY_DIR, os.getpid(), TELEMETRY_INTERVAL)
+
+onsuccess:
+        if TELEMETRY_DIR:
+                telemetry.stop_monitor(TELEMETRY_DIR)
+                telemetry.write_trace(TELEMETRY_DIR, os.path.join(TELEMETRY_DIR, "trace.json"))
+        shell("python {SHARED_SCRIPTS}/container_pool.py --backend {CONTAINER_BACKEND} shutdown")
+        shell("python {SHARED_SCRIPTS}/benchmarks.py --db {BENCHMARK_DB} collect --pipeline evaluate_assemblies "
+              "--samples {config[samples]} --input-column assembly evaluate_assembly/benchmark && "
+              "python {SHARED_SCRIPTS}/benchmarks.py --db {BENCHMARK_DB} report --pipeline evaluate_assemblies evaluate_assembly/benchmark_report")
+
+onerror:
+        shell("python {SHARED_SCRIPTS}/container_pool.py --backend {CONTAINER_BACKEND} shutdown")
+        if TELEMETRY_DIR:
+                telemetry.stop_monitor(TELEMETRY_DIR)
+                telemetry.write_trace(TELEMETRY_DIR, os.path.join(TELEMETRY_DIR, "trace.json"))
+
+# the report rules only read small files of all the samples, and the BUSCO setup runs once for all of them
+# (config, lineage download and split): on a cluster they run in the snakemake process
+localrules: all, merge_quast, generate_table_results, preview_report, create_config_busco, busco_split_lineage
 
 rule all:
         input:
@@ -78,36 +135,10 @@ rule check_header_fasta:
         input:
                 genome=get_genome
         output:
-                'evaluate_assembly/{sample}/FACHECK_ok.txt'
-        run:
-                bad_header = False
-                print("HEADER")
-                with open(input.genome, "r") as ingenome:
-                        for record in SeqIO.parse(ingenome, "fasta"):
-                                print(record.description)
-                                # if len(str(record.id).split(" ")) > 1:
-                                if re.search(r"\s", str(record.description)):
-                                        print("BAD HEADER")
-                                        bad_header = True
-                if bad_header:
-                        print('\033[94m The header of assembly {} is not compatible with REAPR.\nPlease, execute reapr facheck and modify the file assemblies.tsv to point to assembly with corrected header! \033[0m \n\n\n To this y using command line: \033[96m reapr facheck <in.fa> [out_prefix] \033[0m'.format(input.genome))
-                        sequences = []
-                        with open(input.genome, "r") as ingenome:
-                                for record in SeqIO.parse(ingenome, "fasta"):
-                                        header = str(record.description)
-                                        record.id = "_".join(header.split(" "))
-                                        record.description=""
-                                        print(record.id)
-                                        sequences.append(record)
-                        source = Path(input.genome)
-                        destination = Path(input.genome+".bkp")
-                        with destination.open(mode="xb") as fid:
-                                fid.write(source.read_bytes())
-                        with open(str(source), "w") as outgenome:
-                                SeqIO.write(sequences, outgenome, "fasta")
-                        shell('touch {output}')
-                else:
-                        shell('touch {output}')
+                ok='evaluate_assembly/{sample}/FACHECK_ok.txt',
+                fai='evaluate_assembly/{sample}/{sample}.fai'
+        shell:
+                "python scripts/fasta_check.py {input.genome} {output.fai} && touch {output.ok}"
 
 
 rule build_index_bowtie2:
@@ -117,51 +148,58 @@ rule build_index_bowtie2:
         output:
                 'evaluate_assembly/{sample}/{sample}.index_built'
         params:
-                prefix=get_genome_prefix
+                prefix='evaluate_assembly/{sample}/index/{sample}'
+        threads: tool_threads("bowtie2_build")
+        resources:
+                mem_mb=job_resource("bowtie2_build", "mem_mb"),
+                disk_mb=job_resource("bowtie2_build", "disk_mb")
         conda:
                 "envs/myenv.yaml"
         shell:
-                "bowtie2-build {input.fasta} {params.prefix} && touch {output}"
-
-rule bowtie2:
+                "python {SHARED_SCRIPTS}/content_cache.py --cache-dir {CACHE_DIR} --max-size {CACHE_MAX_SIZE} "
+                "index bowtie2 --threads {threads} {input.fasta} {params.prefix} && touch {output}"
+
+if TARGET_COVERAGE:
+        rule subsample:
+                input:
+                        READS
+                output:
+                        MAPPED_READS
+                params:
+                        coverage=TARGET_COVERAGE,
+                        genome_size=config["genome_size"],
+                        seed=config.get("subsample_seed", 11),
+                        threads_record=threads_record("evaluate_assembly/benchmark/reads_subsample.log")
+                benchmark: "evaluate_assembly/benchmark/reads_subsample.log"
+                shell:
+                        "echo {threads} > {params.threads_record} && python {SHARED_SCRIPTS}/subsample_reads.py --cache-dir {CACHE_DIR} --max-size {CACHE_MAX_SIZE} "
+                        "--coverage {params.coverage} --genome-size {params.genome_size} --mode pairs --seed {params.seed} {input} --output {output}"
+
+# reads are piped from the aligner straight into a multithreaded coordinate
+# sort, so no unsorted BAM is ever written to disk
+rule bowtie2_sort_index:
         input:
-                sample=[ config["fq1"], config["fq2"] ],
+                sample=MAPPED_READS,
                 index_bowtie2='evaluate_assembly/{sample}/{sample}.index_built'
         output:
-                'evaluate_assembly/{sample}/{sample}.bam'
+                bam='evaluate_assembly/{sample}/{sample}.sorted.bam',
+                bai='evaluate_assembly/{sample}/{sample}.sorted.bam.bai'
         log:
                 'evaluate_assembly/logs/{sample}_bowtie2.log'
         params:
-                index = get_genome_prefix,
-                extra = "--end-to-end --very-sensitive"
-        threads: config["threads"]
-        conda:
-                "envs/myenv.yaml"
-        wrapper:
-                "0.31.1/bio/bowtie2/align"
-
-rule samtools_sort:
-        input:
-                'evaluate_assembly/{sample}/{sample}.bam'
-        output:
-                'evaluate_assembly/{sample}/{sample}.sorted.bam'
-        params:
-                "-m 4G"
-        threads: config["threads"]
+                index = 'evaluate_assembly/{sample}/index/{sample}',
+                extra = "--end-to-end --very-sensitive",
+                sort_mem = lambda wildcards, threads: sort_setting(threads)[0]
+        threads: tool_threads("bowtie2")
+        resources:
+                mem_mb=job_resource("bowtie2", "mem_mb", extra_mb=lambda threads: sort_setting(threads)[1]),
+                disk_mb=job_resource("bowtie2", "disk_mb")
         conda:
                 "envs/myenv.yaml"
-        wrapper:
-                "0.31.1/bio/samtools/sort"
-
-rule samtools_index:
-        input:
-                'evaluate_assembly/{sample}/{sample}.sorted.bam'
-        output:
-                'evaluate_assembly/{sample}/{sample}.bam.bai'
-        conda:
-                "envs/myenv.yaml"
-        wrapper:
-                "0.31.1/bio/samtools/index"
+        shell:
+                "(bowtie2 --threads {threads} {params.extra} -x {params.index} -1 {input.sample[0]} -2 {input.sample[1]} "
+                "| samtools sort -@ {threads} -m {params.sort_mem} -T {output.bam}.tmp -o {output.bam} - "
+                "&& samtools index {output.bam} {output.bai}) 2> {log}"
 
 
 rule evaluate_assembly_ALE:
@@ -169,22 +207,36 @@ rule evaluate_assembly_ALE:
                 genome = get_genome,
                 r = 'evaluate_assembly/{sample}/{sample}.sorted.bam'
         benchmark: "evaluate_assembly/benchmark/{sample}_ALE.log"
-        output: "evaluate_assembly/{sample}/ALEScore_{sample}.finished"
-        shell: "docker run -u $(id -u):root -v `pwd`:/dir --rm rodtheo/genomics:eval_assem_ale_reapr ALE --nout /dir/{input.r} /dir/{input.genome} /dir/evaluate_assembly/{wildcards.sample}/ALEoutput.txt && touch {output}"
+        resources:
+                mem_mb=job_resource("ale", "mem_mb"),
+                disk_mb=job_resource("ale", "disk_mb")
+        output:
+                finished="evaluate_assembly/{sample}/ALEScore_{sample}.finished",
+                record="evaluate_assembly/{sample}/metrics/ale.json"
+        params:
+                container=pool_run("rodtheo/genomics:eval_assem_ale_reapr"),
+                threads_record=threads_record("evaluate_assembly/benchmark/{sample}_ALE.log")
+        shell: "echo {threads} > {params.threads_record} && {params.container} --user $(id -u):root -- ALE --nout /dir/{input.r} /dir/{input.genome} /dir/evaluate_assembly/{wildcards.sample}/ALEoutput.txt && python {SHARED_SCRIPTS}/metrics.py ale evaluate_assembly/{wildcards.sample}/ALEoutput.txt {output.record} --sample {wildcards.sample} && touch {output.finished}"
 
 rule evaluate_assembly_REAPR:
         input:
                 genome = get_genome,
                 r = 'evaluate_assembly/{sample}/{sample}.sorted.bam',
-                bai = 'evaluate_assembly/{sample}/{sample}.bam.bai'
+                bai = 'evaluate_assembly/{sample}/{sample}.sorted.bam.bai'
         benchmark:
                 'evaluate_assembly/benchmark/{sample}_REAPR.log'
+        resources:
+                mem_mb=job_resource("reapr", "mem_mb"),
+                disk_mb=job_resource("reapr", "disk_mb")
         output:
-                'evaluate_assembly/{sample}/REAPR_{sample}.finished'
+                finished='evaluate_assembly/{sample}/REAPR_{sample}.finished',
+                record='evaluate_assembly/{sample}/metrics/reapr.json'
         params:
-                prefix=get_genome_prefix
+                prefix=get_genome_prefix,
+                container=pool_run("rodtheo/genomics:eval_assem_ale_reapr"),
+                threads_record=threads_record('evaluate_assembly/benchmark/{sample}_REAPR.log')
         shell:
-                "docker run -v `pwd`:/dir --rm rodtheo/genomics:eval_assem_ale_reapr reapr pipeline /dir/{input.genome} /dir/{input.r} /dir/evaluate_assembly/{wildcards.sample}/reapr_results && touch {output}"
+                "echo {threads} > {params.threads_record} && {params.container} -- reapr pipeline /dir/{input.genome} /dir/{input.r} /dir/evaluate_assembly/{wildcards.sample}/reapr_results && python {SHARED_SCRIPTS}/metrics.py reapr evaluate_assembly/{wildcards.sample}/reapr_results/05.summary.report.txt {output.record} --sample {wildcards.sample} && touch {output.finished}"
 #               genome_fachecked = '{}_fachecked'.format(params.prefix)
 #               facheck = subprocess.call(["reapr", "facheck", "{}".format(input.genome)],  stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
 #               print(facheck)
@@ -202,9 +254,9 @@ rule create_config_busco:
         input:
             'config.ini.default'
         output:
-            config='config.ini', lineage = config["lineage"]
+            config='config.ini', lineage = config["lineage"], augustus_env = 'augustus.env'
         run:
-            shell('python scripts/generate_config.py {output.config}')
+            shell('python scripts/generate_config.py {output.config} {output.augustus_env}')
             pathdb = Path(output.lineage)
             print(pathdb)
             if not pathdb.exists():
@@ -217,195 +269,130 @@ rule create_config_busco:
 #        shell: 'python scripts/generate_config.py {output.config} && wget {dataset/busco_bacteria_dataset/bacteria_odb9}'
 
 
-rule busco:
+rule busco_split_lineage:
+        input:
+                lineage = config["lineage"]
+        output:
+                expand('evaluate_assembly/busco_lineage/shard_{shard}/dataset.cfg', shard=BUSCO_SHARDS)
+        params:
+                shards = len(BUSCO_SHARDS)
+        shell:
+                "python {SHARED_SCRIPTS}/busco_shards.py split {input.lineage} evaluate_assembly/busco_lineage --shards {params.shards}"
+
+rule busco_shard:
         input:
                 genome = get_genome,
-                lineage = config["lineage"],
-                initf   = 'config.ini'
+                lineage_cfg = 'evaluate_assembly/busco_lineage/shard_{shard}/dataset.cfg',
+                initf   = 'config.ini',
+                augustus_env = 'augustus.env'
         output:
-                'evaluate_assembly/{sample}/busco/BUSCO_{sample}.finished'
-        benchmark: "evaluate_assembly/benchmark/{sample}_BUSCO.log"
-        params: species=config["species_augustus"]
-        threads: config["threads"]
-        run: 
-
-            #aug_path = os.system("which augustus")
-            aug_path = str(subprocess.Popen("which augustus", shell=True, stdout=subprocess.PIPE).stdout.read())
-            #aug_path = subprocess.check_output(["which", "augustus"])
-            #path_aug = Path(aug_path)
-            print(str(aug_path))
-            path_aug = Path('/'+'/'.join(aug_path.split("/")[1:-2]))
-
-            print("Setting augustus config path environment variable")
-
-            os.environ['AUGUSTUS_CONFIG_PATH'] = str(path_aug/"config/")
+                'evaluate_assembly/{sample}/busco/shard_{shard}/full_table.tsv'
+        benchmark: "evaluate_assembly/benchmark/{sample}_BUSCO_shard{shard}.log"
+        params:
+                species = config["species_augustus"],
+                lineage = 'evaluate_assembly/busco_lineage/shard_{shard}',
+                rundir = 'evaluate_assembly/{sample}/busco/shard_{shard}',
+                container = pool_run("chrishah/busco-docker", mount="/home/working"),
+                threads_record = threads_record("evaluate_assembly/benchmark/{sample}_BUSCO_shard{shard}.log")
+        threads: BUSCO_THREADS
+        resources:
+                mem_mb=job_resource("busco", "mem_mb"),
+                disk_mb=job_resource("busco", "disk_mb")
+        run:
+            shell("echo {threads} > {params.threads_record}")
+            span = telemetry.Span(TELEMETRY_DIR, "run_BUSCO.py", rule="busco_shard", sample=wildcards.sample, shard=wildcards.shard)
             if (config["species_augustus"] == "None"):
-                p = Path('evaluate_assembly/{}/'.format(wildcards.sample))
-                if not p.exists():
-                    shell("mkdir run_{wildcards.sample} && docker run -it --rm -v $(pwd):/home/working -w /home/working chrishah/busco-docker run_BUSCO.py -i {input.genome} -o {wildcards.sample} -l {input.lineage} --mode genome --force && mv run_{wildcards.sample} evaluate_assembly/{wildcards.sample}/ && touch {output}")
-                else:
-                    shell('touch {output}')
-#                shell('export BUSCO_CONFIG_FILE="$PWD/config.ini"  && run_BUSCO.py -i {input.genome} -o {wildcards.sample} -l {input.lineage} --cpu 1 --mode genome && mv run_{wildcards.sample} evaluate_assembly/{wildcards.sample}/ && touch {output}')
+                with span:
+                    shell("{params.container} --workdir /home/working/{params.rundir} -- run_BUSCO.py -i /home/working/{input.genome} -o {wildcards.sample} -l /home/working/{params.lineage} --cpu {threads} --mode genome --force")
             else:
-                shell('export BUSCO_CONFIG_FILE="$PWD/config.ini"  && run_BUSCO.py -f -i {input.genome} -o {wildcards.sample} -l {input.lineage} --cpu 1 --species {params.species} --mode genome')
-                p = Path('evaluate_assembly/{}/'.format(wildcards.sample))
-                if not p.exists():
-                    shell('mv run_{wildcards.sample} evaluate_assembly/{wildcards.sample}/ && touch {output}')
-                else:
-                    shell('touch {output}')
+                with span:
+                    shell('. ./{input.augustus_env} && export BUSCO_CONFIG_FILE="$PWD/config.ini" && workdir=$PWD && cd {params.rundir} && run_BUSCO.py -f -i $workdir/{input.genome} -o {wildcards.sample} -l $workdir/{params.lineage} --cpu {threads} --species {params.species} --mode genome')
+            shell('cp {params.rundir}/run_{wildcards.sample}/full_table_{wildcards.sample}.tsv {output}')
+
+rule busco:
+        input:
+                lineage = config["lineage"],
+                shards = expand('evaluate_assembly/{{sample}}/busco/shard_{shard}/full_table.tsv', shard=BUSCO_SHARDS)
+        output:
+                finished='evaluate_assembly/{sample}/busco/BUSCO_{sample}.finished',
+                record='evaluate_assembly/{sample}/metrics/busco.json',
+                summary='evaluate_assembly/{sample}/run_{sample}/short_summary_{sample}.txt'
+        params:
+                full_table='evaluate_assembly/{sample}/run_{sample}/full_table_{sample}.tsv'
+        shell:
+                "python {SHARED_SCRIPTS}/busco_shards.py merge {input.lineage} {output.summary} {params.full_table} {input.shards} && "
+                "python {SHARED_SCRIPTS}/metrics.py busco {output.summary} {output.record} --sample {wildcards.sample} && touch {output.finished}"
 
 
+# one QUAST job per assembly (reused from the cache when the same assembly was
+# already evaluated), so adding an assembly to samples.tsv only costs its own run
 rule quast:
+        input:
+                genome=get_genome,
+                fasta_ok='evaluate_assembly/{sample}/FACHECK_ok.txt'
+        threads: tool_threads("quast")
+        resources:
+                mem_mb=job_resource("quast", "mem_mb"),
+                disk_mb=job_resource("quast", "disk_mb")
+        benchmark: 'evaluate_assembly/benchmark/{sample}_QUAST.log'
+        output:
+                'evaluate_assembly/{sample}/quast/report.tsv'
+        params:
+                threads_record=threads_record('evaluate_assembly/benchmark/{sample}_QUAST.log')
+        shell:
+                "echo {threads} > {params.threads_record} && python {SHARED_SCRIPTS}/content_cache.py --cache-dir {CACHE_DIR} --max-size {CACHE_MAX_SIZE} "
+                "quast --threads {threads} {input.genome} evaluate_assembly/{wildcards.sample}/quast"
+
+# assembly statistics (N50, GC, N gaps, ...) computed in-process from the FASTA and the
+# index written by check_header_fasta, they only take seconds so the reports do not wait for QUAST
+rule contig_stats:
+        input:
+                genome=get_genome,
+                fasta_ok='evaluate_assembly/{sample}/FACHECK_ok.txt',
+                fai='evaluate_assembly/{sample}/{sample}.fai'
+        output:
+                record='evaluate_assembly/{sample}/metrics/contigs.json',
+                nx='evaluate_assembly/{sample}/contigs/nx.tsv',
+                histogram='evaluate_assembly/{sample}/contigs/length_histogram.tsv'
+        params:
+                genome_size="--genome-size {}".format(config["genome_size"]) if config.get("genome_size") else ""
+        shell:
+                "python {SHARED_SCRIPTS}/contig_stats.py {input.genome} {output.record} --sample {wildcards.sample} "
+                "--fai {input.fai} {params.genome_size} --nx-curve {output.nx} --histogram {output.histogram}"
+
+rule merge_quast:
+        input:
+                expand('evaluate_assembly/{sample}/quast/report.tsv', sample=samples['sample'])
         params:
-                genomes = get_all_genomes,
                 names = get_all_names
-        threads: config['threads']
-        benchmark: 'evaluate_assembly/benchmark/QUAST.log'
         output:
-                'evaluate_assembly/quast_results/QUAST.OK'
+                report='evaluate_assembly/quast_results/report.tsv',
+                ok='evaluate_assembly/quast_results/QUAST.OK'
         shell:
-                'quast.py --labels "{params.names}" -e --threads {threads} -o evaluate_assembly/quast_results/ {params.genomes} && touch {output}'
+                'python {SHARED_SCRIPTS}/merge_quast.py --labels "{params.names}" {output.report} {input} && touch {output.ok}'
 
 
+# the report only reads the per-sample metrics records; the combined table is
+# cached in evaluate_assembly/metrics/combined.json so unchanged records are not read again
 rule generate_table_results:
-        params:
-                genomes_names = get_all_names
         input:
-                ale_res=expand('evaluate_assembly/{sample}/ALEScore_{sample}.finished',sample=samples['sample']),
-                reapr_res=expand('evaluate_assembly/{sample}/REAPR_{sample}.finished',sample=samples['sample']),
-                busco_res=expand('evaluate_assembly/{sample}/busco/BUSCO_{sample}.finished', sample=samples['sample']),
-                quast_res='evaluate_assembly/quast_results/QUAST.OK'
+                ale_res=expand('evaluate_assembly/{sample}/metrics/ale.json', sample=samples['sample']),
+                reapr_res=expand('evaluate_assembly/{sample}/metrics/reapr.json', sample=samples['sample']),
+                busco_res=expand('evaluate_assembly/{sample}/metrics/busco.json', sample=samples['sample']),
+                contigs_res=expand('evaluate_assembly/{sample}/metrics/contigs.json', sample=samples['sample'])
         output: "evaluate_assembly/results.html"
         run:
-                items = []
-                items_classes = []
-                for pseudo_samp in (params.genomes_names).split(","):
-                        samp = pseudo_samp.split("/")[-1]
-                        dict_sample = OrderedDict()
-                        dict_classes = OrderedDict()
-                        dict_sample['name'] = samp
-#                        print(pseudo_samp, samp)
-                        busco_summary_file = "evaluate_assembly/{}/run_{}/short_summary_{}.txt".format(pseudo_samp, samp, samp)
-                        if path.exists(busco_summary_file):
-                                dict_samp = OrderedDict(parse_busco(busco_summary_file))
-                        else:
-                                dict_samp['ncomplete'] = 'X'
-                                dict_samp['pctcomplete'] = 'X'
-                                dict_samp['nduplicated'] = 'X'
-                                dict_samp['pctduplicated'] = 'X'
-                                dict_samp['nfragmented'] = 'X'
-                                dict_samp['pctfragmented'] = 'X'
-                        genome_path = samples.loc[samp, "assembly"]
-                        genome_name  = genome_path.split('/')[-1]
-                        ale_file = "evaluate_assembly/{}/ALEoutput.txt".format(pseudo_samp, genome_name)
-                        if path.exists(ale_file):
-                            with open(ale_file) as infreapr:
-                                    for line in infreapr.readlines():
-                                            match_score = re.match(r'#\sALE_score:\s(-\d+.\d+)', line)
-                                            if match_score:
-                                                    ale_score = float(match_score.group(1))
-                        dict_sample['ale'] = float(ale_score)
-#                        ale_file = "evaluate_assembly/{}/ALEoutput.txt".format(pseudo_samp, genome_name)
-#                        if path.exists(ale_file):
-#                                with open(ale_file, 'r') as inale:
-#                                        nline = 0
-#                                        for line in inale.readlines():
-#                                                if nline == 0:
-#                                                        line_list = line.split(" ")
-#                                                        dict_sample['ale'] = float(line_list[-1].strip('\n'))
-                        # BEGIN - PARSING REAPR RESULTS
-                        with open("evaluate_assembly/{}/reapr_results/05.summary.report.txt".format(samp)) as infreapr:
-                                for line in infreapr.readlines():
-                                        match_errors = re.match(r'^(\d+)\serrors.$', line)
-                                        if match_errors:
-                                                reapr_errors = match_errors.group(1)
-                                        match_fcd_errors = re.match(r'FCD errors within a contig:\s(\d+)', line)
-                                        if match_fcd_errors:
-                                                fcd_errors = match_fcd_errors.group(1)
-                                        match_low_frag_cov = re.match(r'Low fragment coverage within a contig:\s(\d+)', line)
-                                        if match_low_frag_cov:
-                                                low_frag_errors = match_low_frag_cov.group(1)
-                        dict_sample['reapr_total_errors'] = reapr_errors
-                        dict_sample['reapr_fcd'] = fcd_errors
-                        dict_sample['reapr_low'] = low_frag_errors
-                        # END - PARSING REAPR RESULTS
-#                        reapr_file = "evaluate_assembly/{}/reapr_results/05.summary.report.txt".format(pseudo_samp)
-#                        if path.exists(reapr_file):
-#                                with open(reapr_file, 'r') as inreapr:
-#                                        for line in inreapr.readlines():
-#                                                if line.endswith('errors:\n'):
-#                                                        line_list = line.split(" ")
-                       #                                 dict_sample['reapr'] = line_list[0]
-                        # parsing quast results
-                        df_quast = pd.read_table('evaluate_assembly/quast_results/report.tsv', sep='\t')
-                        array_sample = df_quast[samp].values
-                        dict_sample['genomesize'] = '{:,}'.format(int(array_sample[6]))
-                        dict_sample['contigs']    = '{:,}'.format(int(array_sample[12]))
-                        dict_sample['n50']        = '{:,}'.format(int(array_sample[16]))
-                        dict_sample['largest']    = '{:,}'.format(int(array_sample[13]))
-
-                        dict_sample['genomesize'] = int(array_sample[6])
-                        dict_sample['contigs']    = int(array_sample[12])
-                        dict_sample['n50']        = int(array_sample[16])
-                        dict_sample['largest']    = int(array_sample[13])
-                        # concatenating results
-                        # dict_sample['genomesize_class'] = "tg-lboi"
-                        dict_appended = {**dict_sample, **dict_samp}
-                        for k, v in dict_appended.items():
-                                key_class = '{}_class'.format(k)
-                                dict_classes[key_class] = "tg-lboi"
-                        items.append(dict_appended)
-                        items_classes.append(dict_classes)
-                ale_scores = []
-                for it in items:
-                    ale_scores.append(it['ale'])
-                ale_scores = np.array(ale_scores)
-                for it in items:
-                    # min-max normalization
-                    
-                    it['ale_norm'] = '{:.2f}'.format(((it['ale']-np.nanmin(ale_scores))/(np.nanmax(ale_scores)-np.nanmin(ale_scores))))
-                   # print(it['ale'])
-                #myList = [list(col) for col in zip(*[d.values() for d in items])]
-                #myList_argmax = np.argmax(myList, axis=1)
-                #print("argmax",myList_argmax)
-
-                #for idx, arg in enumerate(myList_argmax):
-        #               key_checked = list(dict_appended.keys())[idx]
-#                       key_class = "{}_class".format(key_checked)
-#                       items_classes[arg][key_class] = "mark"
-                        #print("K",items[arg][key_checked])
-                res_items = []
-                df = pd.DataFrame(items)
-                df_unnameA = df.drop('name', axis=1)
-                df_unnameA = df_unnameA.drop('ale_norm', axis=1)
-                print(df_unnameA)
-                df_unname = df_unnameA.apply(pd.to_numeric)
-                print("HERE")
-                df_unname['pct_nonduplicated'] = 100. - df_unname['pctduplicated']
-                df_unname['pct_integral'] = 100. - df_unname['pctfragmented']
-                df_unname['pct_found'] = 100. - df_unname['pctmissing']
-                df_sub = df_unname[['genomesize', 'contigs', 'n50', 'largest', 'pctcomplete', 'pct_nonduplicated', 'pct_integral', 'pct_found']]
-                df_sub['name'] = df['name']
-                df_sub_sorted = df_sub.sort_values('name')
-                df_sub_sorted.columns = ['Genome Size (bp)', 'Number of Contigs', 'N50', 'Largest Contig (bp)', 'BUSCO Complete Genes (%)', 'BUSCO Single-Copy Genes (%)', 'BUSCO Non-fragmented Genes (%)', 'BUSCO Found Genes (%)', 'Assembly']
-                df_sub_sorted = df_sub_sorted[['Assembly', 'Genome Size (bp)', 'Number of Contigs', 'N50', 'Largest Contig (bp)', 'BUSCO Complete Genes (%)', 'BUSCO Single-Copy Genes (%)', 'BUSCO Non-fragmented Genes (%)', 'BUSCO Found Genes (%)']]
-                k = df_sub_sorted.style.hide_index().background_gradient('viridis', axis=0, subset=['Genome Size (bp)', 'Number of Contigs', 'N50', 'Largest Contig (bp)', 'BUSCO Complete Genes (%)', 'BUSCO Single-Copy Genes (%)', 'BUSCO Non-fragmented Genes (%)', 'BUSCO Found Genes (%)'])
-                with open('evaluate_assembly/results_heat.html', 'w') as fheat:
-                    fheat.write(k.render())
-
-                for t in list(zip(items, items_classes)):
-                        nd = {**t[0], **t[1]}
-                        res_items.append(nd)
-                loader = jinja2.FileSystemLoader('template.html')
-                env = jinja2.Environment(loader=loader)
-                template = env.get_template('')
-                output_jinja2 = template.render(items=res_items)
-#               print(output_jinja2)
-                with open(output[0], 'w') as outfile:
-                        outfile.write(output_jinja2)
-                # c = dict([(k,[a[k],b[k]]) for k in items])
-                c = pd.DataFrame(items)
-                c.columns = ['Assembly', 'ALE score (neglog)', 'REAPR erros', 'REAPR fcd', 'REAPR low', 'Assembly length', 'contigs', 'N50', 'Largest contig', 'BUSCO complete (%)', 'BUSCO single (%)', 'BUSCO duplicated (%)', 'BUSCO fragmented (%)', 'BUSCO missing (%)', 'BUSCO complete', 'BUSCO single', 'BUSCO duplicated', 'BUSCO fragmented', 'BUSCO missing', 'ALE normalized']
-                c.to_excel("evaluate_assembly/results.xlsx", index=False)
-                c.to_csv("evaluate_assembly/results.csv", index=False)
+                reports.evaluate_report(list(input), 'evaluate_assembly/metrics/combined.json', REPORT_COLUMNS, 'template.html', 'evaluate_assembly')
                 print("Success ! The results summary table has been written ! \n The results can be view in:\n \t- Excel format in file evaluate_assembly/results.xlsx \n \t- HTML format in file evaluate_assembly/results.html \n \t- HTML heatmap in file evaluate_assembly/results_head.html \n \t- CSV format in file evaluate_assembly/results.csv")
+
+# quick look at a large set of assemblies (snakemake -s Snakefile_evaluate.py -f preview_report):
+# the contig statistics of every assembly plus the ALE/REAPR/BUSCO metrics that are already available
+rule preview_report:
+        input:
+                expand('evaluate_assembly/{sample}/metrics/contigs.json', sample=samples['sample'])
+        output:
+                html='evaluate_assembly/preview.html',
+                csv='evaluate_assembly/preview.csv'
+        run:
+                finished = reports.existing(expand('evaluate_assembly/{sample}/metrics/{tool}.json', sample=samples['sample'], tool=['ale', 'reapr', 'busco']))
+                reports.preview_report(list(input) + finished, 'evaluate_assembly/metrics/preview.json', PREVIEW_COLUMNS, output.html, output.csv)
@@ -0,0 +1,137 @@
+"""Check (and repair) FASTA headers for REAPR while writing a samtools .fai index.
+
+The assembly is streamed once, line by line. Headers containing whitespace are
+rewritten with the whitespace replaced by underscores (the same fix that
+``reapr facheck`` applies). Nothing is written for an assembly whose headers are
+already fine except the index; when a bad header shows up the repaired copy is
+written next to the input and, at the end, the original is renamed to
+``<assembly>.bkp`` and the repaired copy takes its place.
+
+A sequence wrapped with lines of different lengths cannot be indexed (samtools
+refuses it too), but it is still a valid assembly: the check passes and the
+index is left empty, so the readers of the index fall back to parsing the FASTA.
+
+Usage: python scripts/fasta_check.py <assembly.fa> <out.fai>
+"""
+import os
+import re
+import sys
+
+WHITESPACE = re.compile(rb"\s")
+COPY_BUFSIZE = 1024 * 1024
+
+
+class FaiRecord(object):
+    """Per-sequence bookkeeping needed for one line of a .fai file."""
+
+    def __init__(self, name, offset):
+        self.name = name
+        self.offset = offset
+        self.length = 0
+        self.linebases = None
+        self.linewidth = None
+        self.short_line_seen = False
+        self.uneven = False
+
+    def add_line(self, bases, width):
+        # samtools only accepts a shorter line as the last one of a sequence
+        if self.short_line_seen:
+            self.uneven = True
+        if self.linebases is None:
+            self.linebases, self.linewidth = bases, width
+        elif bases != self.linebases or width != self.linewidth:
+            if bases > self.linebases:
+                self.uneven = True
+            self.short_line_seen = True
+        self.length += bases
+
+    def fai_line(self):
+        return "{}\t{}\t{}\t{}\t{}\n".format(self.name.decode(), self.length, self.offset,
+                                            self.linebases or 0, self.linewidth or 0)
+
+
+def fix_header(line):
+    """Return the header line with every inner whitespace turned into '_'."""
+    body = line[1:].rstrip()
+    return b">" + WHITESPACE.sub(b"_", body)
+
+
+def check_and_index(genome, fai_path):
+    """Stream ``genome`` once, repair its headers if needed and write ``fai_path``.
+
+    Returns the list of original headers that had to be repaired and the names
+    of the unevenly wrapped sequences (the index is empty when there are any).
+    """
+    repaired_path = genome + ".facheck.tmp"
+    backup_path = genome + ".bkp"
+    bad_headers = []
+    records = []
+    outfasta = None
+    in_pos = 0
+    out_pos = 0
+    current = None
+    with open(genome, "rb") as ingenome:
+        for line in ingenome:
+            in_pos_line = in_pos
+            in_pos += len(line)
+            if line.startswith(b">"):
+                header = line[1:].rstrip(b"\r\n")
+                if WHITESPACE.search(header.rstrip()) or header != header.rstrip():
+                    bad_headers.append(header.decode(errors="replace"))
+                    if outfasta is None:
+                        if os.path.exists(backup_path):
+                            raise FileExistsError("Backup {} already exists".format(backup_path))
+                        outfasta = open(repaired_path, "wb")
+                        # copy the (already good) bytes seen before the first bad header
+                        with open(genome, "rb") as prefix:
+                            remaining = in_pos_line
+                            while remaining:
+                                chunk = prefix.read(min(COPY_BUFSIZE, remaining))
+                                outfasta.write(chunk)
+                                remaining -= len(chunk)
+                    newline = b"\r\n" if line.endswith(b"\r\n") else b"\n"
+                    line = fix_header(line) + newline
+                if outfasta is not None:
+                    outfasta.write(line)
+                out_pos += len(line)
+                current = FaiRecord(fix_header(line)[1:], out_pos)
+                records.append(current)
+                continue
+            if outfasta is not None:
+                outfasta.write(line)
+            out_pos += len(line)
+            bases = len(line.rstrip(b"\r\n"))
+            if current is None or bases == 0:
+                continue
+            current.add_line(bases, len(line))
+
+    if outfasta is not None:
+        outfasta.close()
+        os.replace(genome, backup_path)
+        os.replace(repaired_path, genome)
+
+    uneven = [record.name.decode() for record in records if record.uneven]
+    with open(fai_path, "w") as outfai:
+        if not uneven:
+            for record in records:
+                outfai.write(record.fai_line())
+    return bad_headers, uneven
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    genome, fai_path = sys.argv[1], sys.argv[2]
+    try:
+        bad_headers, uneven = check_and_index(genome, fai_path)
+    except Exception:
+        if os.path.exists(genome + ".facheck.tmp"):
+            os.remove(genome + ".facheck.tmp")
+        raise
+    if bad_headers:
+        print('\033[94m The header of assembly {} is not compatible with REAPR ({} bad headers, e.g. "{}").\n'
+              'The headers were repaired in place and the original file was kept in {}.bkp \033[0m'.format(
+                  genome, len(bad_headers), bad_headers[0], genome))
+    if uneven:
+        print("The lines of {} sequence(s) of {} are not wrapped evenly (e.g. {}), {} is left empty".format(
+            len(uneven), genome, uneven[0], fai_path))
@@ -1,25 +1,30 @@
-import os
-import subprocess
+import shutil
+import sys
 from pathlib import Path
 
-#aug_path = os.system("which augustus")
-aug_path = str(subprocess.Popen("which augustus", shell=True, stdout=subprocess.PIPE).stdout.read())
-#aug_path = subprocess.check_output(["which", "augustus"])
-#path_aug = Path(aug_path)
-print(str(aug_path))
-path_aug = Path('/'+'/'.join(aug_path.split("/")[1:-2]))
+# usage: python scripts/generate_config.py [config.ini] [augustus.env]
+config_p = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("config.ini")
+augustus_env = Path(sys.argv[2]) if len(sys.argv) > 2 else config_p.parent/"augustus.env"
 
-print("Setting augustus config path environment variable")
-os.environ['AUGUSTUS_CONFIG_PATH'] = str(path_aug/"config/")
+# augustus is installed as <prefix>/bin/augustus, its config and scripts live in <prefix>
+aug_path = shutil.which("augustus")
 
 print("Setting busco config.ini script")
 
 config_def = Path("config.ini.default")
-config_p  = config_def.parent/"config.ini"
 
 config_p.write_text(config_def.read_text())
 
-with open(config_p, "+a") as conf_file:
+if aug_path is None:
+    # only the dockerized busco (species_augustus: "None") can run without a local augustus
+    print("augustus was not found in $PATH, the augustus paths are left unset")
+    augustus_env.write_text("# augustus was not found in $PATH\n")
+    sys.exit(0)
+
+path_aug = Path(aug_path).parent.parent
+print(path_aug)
+
+with open(str(config_p), "a") as conf_file:
     conf_file.write("[gff2gbSmallDNA.pl]\n")
     conf_file.write("path = {}/scripts/\n".format(str(path_aug)))
 
@@ -29,9 +34,6 @@ with open(config_p, "+a") as conf_file:
     conf_file.write("[optimize_augustus.pl]\n")
     conf_file.write("path = {}/scripts/\n".format(str(path_aug)))
 
-
-
-
-
-print(path_aug)
-#export AUGUSTUS_CONFIG_PATH="/home/rodtheo/miniconda2/envs/evaluate_assemblies_env/config/"
+# resolved once per run, every busco job sources this file
+print("Writing augustus config path environment variable to {}".format(augustus_env))
+augustus_env.write_text('export AUGUSTUS_CONFIG_PATH="{}"\n'.format(path_aug/"config"))
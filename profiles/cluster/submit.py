@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Cluster submit command of the snakemake profiles, logging when every job is queued and started.
+
+snakemake calls it with the job script as last argument. The job script is
+wrapped in a script that appends the start and end time of the job to the
+queue log before and after running it. The wrapper is then given to the batch
+system (``-- sbatch ...``), or, with ``--local``, started in the background
+after ``--queue-delay`` seconds, a stand-in for the cluster to try the rule
+groups of the profile on one machine. The profile itself runs locally when
+``SNAKEMAKE_PIPELINES_LOCAL_QUEUE_DELAY`` is set to the queue delay, so both
+ways share the groups of the profile. ``scripts/queue_report.py`` reads the
+log back.
+
+When the workflow runs with telemetry (``telemetry_interval``), the wrapper
+also samples the CPU, memory and I/O of the job on its node with
+``scripts/telemetry.py monitor``, into ``jobs/<token>`` of the telemetry
+directory, so the cluster jobs show in the timeline of the run.
+
+Usage (in the ``cluster`` entry of a profile):
+    ../profiles/cluster/submit.py --log .snakemake/cluster_queue.tsv -- sbatch --parsable <options> <jobscript>
+    ../profiles/cluster/submit.py --log .snakemake/cluster_queue.tsv --local --queue-delay 20 <jobscript>
+"""
+import argparse
+import json
+import os
+import shlex
+import stat
+import subprocess
+import sys
+import time
+import uuid
+
+# token, event (submitted, started, finished), time, group, rule of every job, cluster job id or host
+LOG_FIELDS = ["token", "event", "time", "group", "rules", "detail"]
+TELEMETRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts", "telemetry.py")
+# exported by telemetry.start_monitor in the snakemake process, which runs this script
+TELEMETRY_DIR_ENV = "SNAKEMAKE_PIPELINES_TELEMETRY_DIR"
+TELEMETRY_INTERVAL_ENV = "SNAKEMAKE_PIPELINES_TELEMETRY_INTERVAL"
+# set (to the fake queue wait in seconds) to run the submissions of the profile on this machine
+LOCAL_ENV = "SNAKEMAKE_PIPELINES_LOCAL_QUEUE_DELAY"
+
+
+def option_values(args, option):
+    """The values that follow ``option`` in the command line ``args``."""
+    if option not in args:
+        return []
+    values = []
+    for arg in args[args.index(option) + 1:]:
+        if arg.startswith("-"):
+            break
+        values.append(arg)
+    return values
+
+
+def read_properties(jobscript):
+    """The job properties snakemake writes in the job script, and the rule of every job it runs.
+
+    snakemake 7 lists the jobs of a group (``--target-jobs rule:wildcards``);
+    older versions only give the rules the group may run, one entry per rule.
+    """
+    properties, rules, jobs = {}, [], []
+    with open(jobscript) as injob:
+        for line in injob:
+            if line.startswith("# properties = "):
+                properties = json.loads(line[len("# properties = "):])
+            elif "--allowed-rules" in line or "--target-jobs" in line:
+                args = shlex.split(line)
+                rules = option_values(args, "--allowed-rules")
+                jobs = [spec.partition(":")[0] for spec in option_values(args, "--target-jobs")]
+    if properties.get("type") != "group" and properties.get("rule"):
+        return properties, [properties["rule"]]
+    return properties, jobs or rules
+
+
+def log_line(token, event, when, group="", rules="", detail=""):
+    return "\t".join([token, event, "{:.3f}".format(when), group, rules, detail]) + "\n"
+
+
+def append_log(log, line):
+    with open(log, "a") as outlog:
+        outlog.write(line)
+
+
+def monitor_command(token, label):
+    """Shell command sampling the job on its node, None when the workflow runs without telemetry."""
+    telemetry_dir = os.environ.get(TELEMETRY_DIR_ENV)
+    if not telemetry_dir:
+        return None
+    return "{} {} monitor {} --pid $$ --interval {} --no-containers --label {}".format(
+        shlex.quote(sys.executable), shlex.quote(os.path.abspath(TELEMETRY)),
+        shlex.quote(os.path.join(telemetry_dir, "jobs", token)),
+        shlex.quote(os.environ.get(TELEMETRY_INTERVAL_ENV, "5")), shlex.quote(label))
+
+
+def wrap(jobscript, log, token, label=""):
+    """Write the job script that logs the start and end of ``jobscript``, returns its path."""
+    with open(jobscript) as injob:
+        header = [line for line in injob.readlines()[:2] if line.startswith("#")]
+    wrapper = jobscript + ".queued.sh"
+    record = 'printf "{}\\t%s\\t%s\\t\\t\\t%s\\n" {{event}} "$(date +%s.%N)" "$(hostname)" >> {}'.format(
+        token, shlex.quote(log))
+    with open(wrapper, "w") as outwrapper:
+        outwrapper.write("#!/bin/sh\n")
+        outwrapper.writelines(line for line in header if not line.startswith("#!"))
+        outwrapper.write(record.format(event="started") + "\n")
+        monitor = monitor_command(token, label)
+        if monitor:
+            outwrapper.write("{} >/dev/null 2>&1 &\nmonitor=$!\n".format(monitor))
+        outwrapper.write("/bin/sh {}\nstatus=$?\n".format(shlex.quote(jobscript)))
+        if monitor:
+            outwrapper.write("kill $monitor 2>/dev/null; wait $monitor\n")
+        outwrapper.write(record.format(event="finished") + "\n")
+        outwrapper.write("exit $status\n")
+    os.chmod(wrapper, os.stat(wrapper).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--log", default=".snakemake/cluster_queue.tsv")
+    parser.add_argument("--local", action="store_true", help="run the jobs on this machine instead of submitting them")
+    parser.add_argument("--queue-delay", type=float, default=0, help="seconds a local job waits, as if queued")
+    parser.add_argument("submit", nargs="*", help="submit command of the batch system, e.g. sbatch --parsable")
+    parser.add_argument("jobscript")
+    args = parser.parse_args()
+    if os.environ.get(LOCAL_ENV):
+        args.local, args.queue_delay = True, float(os.environ[LOCAL_ENV])
+    if not args.local and not args.submit:
+        parser.error("give the submit command of the batch system after --, or --local")
+
+    log = os.path.abspath(args.log)
+    if os.path.dirname(log):
+        os.makedirs(os.path.dirname(log), exist_ok=True)
+    jobscript = os.path.abspath(args.jobscript)
+    properties, rules = read_properties(jobscript)
+    token = uuid.uuid4().hex[:12]
+    group = properties.get("groupid", "") if properties.get("type") == "group" else ""
+    names = ",".join(sorted(set(rules), key=rules.index))
+    label = "group {}: {}".format(group, names) if group else names
+    wrapper = wrap(jobscript, log, token, label)
+
+    submitted = time.time()
+    if args.local:
+        command = "sleep {} && exec {}".format(args.queue_delay, shlex.quote(wrapper))
+        proc = subprocess.Popen(["/bin/sh", "-c", command], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, start_new_session=True)
+        job_id = str(proc.pid)
+    else:
+        job_id = subprocess.run(args.submit + [wrapper], stdout=subprocess.PIPE, universal_newlines=True,
+                                check=True).stdout.strip()
+    append_log(log, log_line(token, "submitted", submitted, group, ",".join(rules), job_id))
+    # snakemake reads the cluster job id from the standard output
+    print(job_id)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""Collect the snakemake ``benchmark:`` files of every run into a local database.
+
+``collect`` reads the benchmark TSVs written by the rules (wall time, max_rss,
+io_in/out, ...) and stores one row per measurement in a sqlite database, with
+the rule and sample parsed from the file name (``<sample>_<rule>.log``), the
+version of the tool, the size of the sample input and the number of threads the
+job ran with, which the rules write next to their benchmark file
+(``<sample>_<rule>.log.threads``). A benchmark file is stored only once, so
+collecting after every run only adds the jobs that actually ran.
+
+``report`` writes two tables out of the database:
+
+- ``comparison.tsv``: the latest wall time and memory of every rule for every
+  sample, side by side, e.g. flye against wtdbg2 on the same reads. The shards
+  and chunks of a rule (``BUSCO_shard0``, ``wtdbg2_consensus_chunk1``, ...)
+  make one column: their wall times are added up and the largest max_rss is kept;
+- ``regressions.tsv``: the latest runs whose wall time or max_rss is more than
+  ``--threshold`` above the median of the earlier runs of the same rule, sample,
+  tool version, input size and thread count.
+
+Usage:
+    python scripts/benchmarks.py collect --db <benchmarks.sqlite> --pipeline <name> --samples samples.tsv --input-column raw_fastq <benchmark_dir> [...]
+    python scripts/benchmarks.py report --db <benchmarks.sqlite> [--pipeline <name>] [--threshold 0.2] <out_dir>
+"""
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+from content_cache import tool_version
+
+DEFAULT_DB = os.path.join("~", ".cache", "snakemake_pipelines", "benchmarks.sqlite")
+# benchmark columns written by snakemake (older versions only write the first two)
+MEASURES = OrderedDict([
+    ("s", "seconds"),
+    ("max_rss", "max_rss"),
+    ("max_vms", "max_vms"),
+    ("max_uss", "max_uss"),
+    ("max_pss", "max_pss"),
+    ("io_in", "io_in"),
+    ("io_out", "io_out"),
+    ("mean_load", "mean_load"),
+])
+# how to ask each tool for its version, by the rule name used in the benchmark files
+VERSION_COMMANDS = {
+    "wtdbg2": ["wtdbg2", "-V"],
+    "wtdbg2_consensus": ["wtpoa-cns", "-V"],
+    "flye": ["flye", "--version"],
+    "RA": ["ra", "--version"],
+    "QUAST": ["quast.py", "--version"],
+    "ALE": ["docker", "image", "inspect", "-f", "{{.Id}}", "rodtheo/genomics:eval_assem_ale_reapr"],
+    "REAPR": ["docker", "image", "inspect", "-f", "{{.Id}}", "rodtheo/genomics:eval_assem_ale_reapr"],
+    "BUSCO": ["run_BUSCO.py", "--version"],
+    "ltr_retriever": ["LTR_retriever", "-h"],
+}
+# suffix of the benchmark files of the jobs that run one part of a rule
+PART_SUFFIX = re.compile(r"_(shard|chunk)\d+$")
+# file next to each benchmark file with the number of threads of the job
+THREADS_SUFFIX = ".threads"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collected_at TEXT,
+    pipeline TEXT
+);
+CREATE TABLE IF NOT EXISTS benchmarks (
+    run_id INTEGER REFERENCES runs(run_id),
+    pipeline TEXT,
+    rule TEXT,
+    sample TEXT,
+    tool_version TEXT,
+    input_path TEXT,
+    input_size INTEGER,
+    threads INTEGER,
+    repeat INTEGER,
+    seconds REAL,
+    max_rss REAL,
+    max_vms REAL,
+    max_uss REAL,
+    max_pss REAL,
+    io_in REAL,
+    io_out REAL,
+    mean_load REAL,
+    path TEXT,
+    mtime_ns INTEGER,
+    UNIQUE (path, mtime_ns, repeat)
+);
+"""
+
+
+def connect(db_path):
+    db_path = os.path.expanduser(db_path)
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def read_samples(samples_tsv, input_column):
+    """OrderedDict sample -> input file of the sample (None when there is no such column)."""
+    with open(samples_tsv, newline="") as insamples:
+        return OrderedDict((row["sample"], row.get(input_column)) for row in csv.DictReader(insamples, delimiter="\t"))
+
+
+def split_name(filename, samples):
+    """(sample, rule) out of a benchmark file name like 'Sample1_BUSCO_shard0.log'."""
+    stem = os.path.splitext(filename)[0]
+    # the longest matching sample wins, sample names may contain '_'
+    for sample in sorted(samples, key=len, reverse=True):
+        if stem.startswith(sample + "_"):
+            return sample, stem[len(sample) + 1:]
+    sample, _, rule = stem.partition("_")
+    return sample, rule
+
+
+def read_benchmark(path):
+    """One OrderedDict of measures per repeat of a snakemake benchmark TSV."""
+    with open(path, newline="") as inbench:
+        rows = list(csv.DictReader(inbench, delimiter="\t"))
+    measurements = []
+    for row in rows:
+        values = OrderedDict()
+        for column, name in MEASURES.items():
+            try:
+                values[name] = float(row[column])
+            except (KeyError, TypeError, ValueError):
+                values[name] = None
+        measurements.append(values)
+    return measurements
+
+
+def read_threads(path):
+    """Threads the job of the benchmark file ``path`` ran with, None when the rule did not write them."""
+    try:
+        with open(path + THREADS_SUFFIX) as inthreads:
+            return int(inthreads.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def base_rule_of(rule):
+    """Rule without the shard or chunk suffix, e.g. 'BUSCO' for 'BUSCO_shard2'."""
+    return PART_SUFFIX.sub("", rule)
+
+
+def version_of(rule, versions):
+    base_rule = base_rule_of(rule)
+    if base_rule not in versions:
+        try:
+            versions[base_rule] = tool_version(VERSION_COMMANDS[base_rule]) if base_rule in VERSION_COMMANDS else ""
+        except (OSError, subprocess.CalledProcessError):
+            versions[base_rule] = ""
+    return versions[base_rule]
+
+
+def collect(conn, pipeline, benchmark_dirs, samples):
+    """Store the benchmark files not seen before, returns the number of new rows."""
+    versions = {}
+    with conn:
+        run_id = conn.execute("INSERT INTO runs (collected_at, pipeline) VALUES (?, ?)",
+                              (time.strftime("%Y-%m-%d %H:%M:%S"), pipeline)).lastrowid
+        added = 0
+        for benchmark_dir in benchmark_dirs:
+            if not os.path.isdir(benchmark_dir):
+                continue
+            for filename in sorted(os.listdir(benchmark_dir)):
+                if filename.endswith(THREADS_SUFFIX):
+                    continue
+                path = os.path.abspath(os.path.join(benchmark_dir, filename))
+                mtime_ns = os.stat(path).st_mtime_ns
+                if conn.execute("SELECT 1 FROM benchmarks WHERE path = ? AND mtime_ns = ?",
+                                (path, mtime_ns)).fetchone():
+                    continue
+                sample, rule = split_name(filename, samples)
+                input_path = samples.get(sample)
+                input_size = os.path.getsize(input_path) if input_path and os.path.exists(input_path) else None
+                threads = read_threads(path)
+                for repeat, values in enumerate(read_benchmark(path)):
+                    conn.execute(
+                        "INSERT INTO benchmarks (run_id, pipeline, rule, sample, tool_version, input_path, input_size, "
+                        "threads, repeat, {}, path, mtime_ns) VALUES ({})".format(
+                            ", ".join(values), ", ".join("?" * (11 + len(values)))),
+                        [run_id, pipeline, rule, sample, version_of(rule, versions), input_path, input_size,
+                         threads, repeat] + list(values.values()) + [path, mtime_ns])
+                    added += 1
+    return added
+
+
+def latest_rows(conn, pipeline=None):
+    """Rows of the most recent measurement of every (pipeline, rule, sample), averaged over repeats."""
+    query = ("SELECT pipeline, rule, sample, input_size, threads, tool_version, AVG(seconds), AVG(max_rss) "
+             "FROM benchmarks b WHERE run_id = (SELECT MAX(run_id) FROM benchmarks l WHERE l.pipeline = b.pipeline "
+             "AND l.rule = b.rule AND l.sample = b.sample){} GROUP BY pipeline, rule, sample ORDER BY sample, rule")
+    if pipeline:
+        return conn.execute(query.format(" AND pipeline = ?"), (pipeline,)).fetchall()
+    return conn.execute(query.format("")).fetchall()
+
+
+def comparison_table(conn, pipeline=None):
+    """Rows (sample, input_size, then seconds and max_rss of every rule) of the latest runs."""
+    rules, samples = OrderedDict(), OrderedDict()
+    for _, rule, sample, input_size, _, _, seconds, max_rss in latest_rows(conn, pipeline):
+        rule = base_rule_of(rule)
+        rules[rule] = None
+        values = samples.setdefault(sample, {"input_size": input_size})
+        if rule in values:
+            previous_seconds, previous_rss = values[rule]
+            seconds = None if seconds is None or previous_seconds is None else previous_seconds + seconds
+            max_rss = max([rss for rss in (previous_rss, max_rss) if rss is not None], default=None)
+        values[rule] = (seconds, max_rss)
+    header = ["sample", "input_size"]
+    for rule in rules:
+        header += ["{} s".format(rule), "{} max_rss".format(rule)]
+    table = [header]
+    for sample, values in samples.items():
+        row = [sample, values["input_size"]]
+        for rule in rules:
+            row += list(values.get(rule, (None, None)))
+        table.append(row)
+    return table
+
+
+def find_regressions(conn, threshold=0.2, pipeline=None):
+    """Latest runs whose wall time or max_rss is above (1 + threshold) times the median of the earlier runs."""
+    regressions = []
+    for pipe, rule, sample, input_size, threads, version, seconds, max_rss in latest_rows(conn, pipeline):
+        history = conn.execute(
+            "SELECT AVG(seconds), AVG(max_rss) FROM benchmarks WHERE pipeline = ? AND rule = ? AND sample = ? "
+            "AND tool_version IS ? AND input_size IS ? AND threads IS ? AND run_id < (SELECT MAX(run_id) FROM "
+            "benchmarks WHERE pipeline = ? AND rule = ? AND sample = ?) GROUP BY run_id",
+            (pipe, rule, sample, version, input_size, threads, pipe, rule, sample)).fetchall()
+        for index, (measure, value) in enumerate([("seconds", seconds), ("max_rss", max_rss)]):
+            previous = [row[index] for row in history if row[index] is not None]
+            if value is None or not previous:
+                continue
+            median = statistics.median(previous)
+            if median > 0 and value > median * (1 + threshold):
+                regressions.append([pipe, rule, sample, version, measure, median, value,
+                                    round(100.0 * (value - median) / median, 1)])
+    return regressions
+
+
+def write_tsv(path, rows):
+    with open(path, "w", newline="") as outtsv:
+        csv.writer(outtsv, delimiter="\t", lineterminator="\n").writerows(
+            [["NA" if value is None else value for value in row] for row in rows])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", default=DEFAULT_DB)
+    subparsers = parser.add_subparsers(dest="command")
+    collect_parser = subparsers.add_parser("collect", help="store the new benchmark files")
+    collect_parser.add_argument("--pipeline", required=True)
+    collect_parser.add_argument("--samples", help="samples.tsv of the run")
+    collect_parser.add_argument("--input-column", default="raw_fastq", help="column of samples.tsv with the input file")
+    collect_parser.add_argument("benchmark_dirs", nargs="+")
+    report_parser = subparsers.add_parser("report", help="write the comparison and regression tables")
+    report_parser.add_argument("--pipeline")
+    report_parser.add_argument("--threshold", type=float, default=0.2,
+                               help="relative increase over the median of earlier runs flagged as a regression")
+    report_parser.add_argument("out_dir")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        samples = read_samples(args.samples, args.input_column) if args.samples else OrderedDict()
+        conn = connect(args.db)
+        added = collect(conn, args.pipeline, args.benchmark_dirs, samples)
+        print("Stored {} new benchmark measurements in {}".format(added, args.db))
+    elif args.command == "report":
+        conn = connect(args.db)
+        os.makedirs(args.out_dir, exist_ok=True)
+        write_tsv(os.path.join(args.out_dir, "comparison.tsv"), comparison_table(conn, args.pipeline))
+        regressions = find_regressions(conn, args.threshold, args.pipeline)
+        write_tsv(os.path.join(args.out_dir, "regressions.tsv"),
+                  [["pipeline", "rule", "sample", "tool_version", "measure", "median_before", "latest", "increase_pct"]]
+                  + regressions)
+        for pipe, rule, sample, _, measure, median, value, increase in regressions:
+            print("Regression: {} {} {} {} went from {} to {} (+{}%)".format(
+                pipe, rule, sample, measure, median, value, increase), file=sys.stderr)
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Sharded megablast of an assembly with a per-contig hit cache.
+
+``split`` hashes every contig (sha256 of the upper-cased sequence) and looks it
+up in a sqlite cache of earlier searches. The cache is keyed by the contig hash
+and by a version of the database and search options. Only the contigs not found
+there are written to the query shards, once per distinct sequence, whole and
+balanced by size (largest first into the shard with the fewest bases). So
+polished or re-scaffolded versions of an assembly only search the contigs that
+changed. The assembly is streamed line by line twice, once to hash and measure
+the contigs and once to copy the ones to search into their shards, so only the
+hashes and lengths are held in memory, never the sequences.
+
+``merge`` stores the hits of the shards in the cache, including the contigs
+without hits, and writes the hit file of the whole assembly. Contigs are
+written in their original order, and every hit line carries the contig's own
+name, in the ``-outfmt '6 qseqid staxids bitscore std'`` format blobtools
+expects.
+
+Usage:
+    python scripts/blast_shards.py split <assembly.fa> <out_dir> --shards N --db <blast_db> [--cache-db hits.sqlite] [--options "..."]
+    python scripts/blast_shards.py merge <out_dir> <hits.out> <shard_hits> [...] [--cache-db hits.sqlite]
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import heapq
+import os
+import sqlite3
+import subprocess
+
+from content_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_CACHE_DB = os.path.join(DEFAULT_CACHE_DIR, "blast_hits.sqlite")
+# '6 qseqid staxids bitscore std': the query id is the first column and again the first of std
+QSEQID_COLUMNS = (0, 3)
+
+
+def connect(cache_db):
+    cache_db = os.path.expanduser(cache_db)
+    if os.path.dirname(cache_db):
+        os.makedirs(os.path.dirname(cache_db), exist_ok=True)
+    conn = sqlite3.connect(cache_db, timeout=600)
+    conn.execute("CREATE TABLE IF NOT EXISTS hits (seq_hash TEXT, search_version TEXT, lines TEXT, "
+                 "PRIMARY KEY (seq_hash, search_version))")
+    return conn
+
+
+def db_version(db, options):
+    """Hash of the BLAST database description (date, sequences, letters) and of the search options."""
+    try:
+        info = subprocess.run(["blastdbcmd", "-db", db, "-info"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        # without blastdbcmd, the size and modification time of the database files
+        info = "\n".join("{} {} {}".format(os.path.basename(path), os.path.getsize(path), os.path.getmtime(path))
+                         for path in sorted(glob.glob(db + ".*")))
+    return hashlib.sha256("\0".join([info, options]).encode()).hexdigest()
+
+
+def hash_contigs(assembly):
+    """Yield (name, sequence hash, length) of the contigs of ``assembly``."""
+    name, digest, length = None, None, 0
+    with open(assembly) as inassembly:
+        for line in inassembly:
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, digest.hexdigest(), length
+                name, digest, length = line[1:].split()[0], hashlib.sha256(), 0
+            elif name is not None:
+                bases = line.strip()
+                digest.update(bases.upper().encode())
+                length += len(bases)
+    if name is not None:
+        yield name, digest.hexdigest(), length
+
+
+def split_assembly(assembly, out_dir, shards, version, cache_db):
+    """Write shard_<i>.fa, order.tsv, queries.tsv and search_version into ``out_dir``, returns the number of contigs to search."""
+    conn = connect(cache_db)
+    os.makedirs(out_dir, exist_ok=True)
+    order, pending = [], {}
+    for name, seq_hash, length in hash_contigs(assembly):
+        order.append((name, seq_hash))
+        if seq_hash in pending:
+            continue
+        cached = conn.execute("SELECT 1 FROM hits WHERE seq_hash = ? AND search_version = ?",
+                              (seq_hash, version)).fetchone()
+        if not cached:
+            pending[seq_hash] = length
+    conn.close()
+
+    # shards of an earlier split with more shards would be taken as searched by merge
+    for stale in glob.glob(os.path.join(out_dir, "shard_*.fa")):
+        os.remove(stale)
+    # queries are named q<n> so BLAST does not reinterpret contig names containing '|'
+    queries, target = [], {}
+    heap = [(0, shard) for shard in range(shards)]
+    for seq_hash, length in sorted(pending.items(), key=lambda item: item[1], reverse=True):
+        bases, shard = heapq.heappop(heap)
+        query = "q{}".format(len(queries))
+        queries.append((query, seq_hash))
+        target[seq_hash] = (shard, query)
+        heapq.heappush(heap, (bases + length, shard))
+
+    handles = [open(os.path.join(out_dir, "shard_{}.fa".format(shard)), "w") for shard in range(shards)]
+    try:
+        # second pass: the contigs are copied in assembly order, the first copy of every sequence to search
+        contigs = iter(order)
+        handle = None
+        with open(assembly) as inassembly:
+            for line in inassembly:
+                if line.startswith(">"):
+                    _, seq_hash = next(contigs)
+                    handle = None
+                    if seq_hash in target:
+                        shard, query = target.pop(seq_hash)
+                        handle = handles[shard]
+                        handle.write(">{}\n".format(query))
+                elif handle is not None and line.strip():
+                    handle.write(line.strip() + "\n")
+    finally:
+        for handle in handles:
+            handle.close()
+    with open(os.path.join(out_dir, "order.tsv"), "w", newline="") as outorder:
+        csv.writer(outorder, delimiter="\t", lineterminator="\n").writerows(order)
+    with open(os.path.join(out_dir, "queries.tsv"), "w", newline="") as outqueries:
+        csv.writer(outqueries, delimiter="\t", lineterminator="\n").writerows(queries)
+    with open(os.path.join(out_dir, "search_version"), "w") as outversion:
+        outversion.write(version + "\n")
+    return len(pending)
+
+
+def merge_hits(out_dir, shard_hits, output, cache_db):
+    """Cache the hits of the shards and write the hits of every contig of the assembly, in order."""
+    with open(os.path.join(out_dir, "search_version")) as inversion:
+        version = inversion.read().strip()
+    with open(os.path.join(out_dir, "order.tsv"), newline="") as inorder:
+        order = [tuple(row) for row in csv.reader(inorder, delimiter="\t")]
+    with open(os.path.join(out_dir, "queries.tsv"), newline="") as inqueries:
+        hash_of = dict(tuple(row) for row in csv.reader(inqueries, delimiter="\t"))
+
+    # every query written to a shard was searched, also the ones without hits
+    searched = {seq_hash: [] for seq_hash in hash_of.values()}
+    for path in shard_hits:
+        with open(path) as inhits:
+            for line in inhits:
+                if line.strip():
+                    searched[hash_of[line.split("\t", 1)[0]]].append(line.rstrip("\n"))
+
+    conn = connect(cache_db)
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO hits (seq_hash, search_version, lines) VALUES (?, ?, ?)",
+                         [(seq_hash, version, "\n".join(lines)) for seq_hash, lines in searched.items()])
+    written = 0
+    with open(output, "w") as outhits:
+        for name, seq_hash in order:
+            if seq_hash in searched:
+                lines = searched[seq_hash]
+            else:
+                row = conn.execute("SELECT lines FROM hits WHERE seq_hash = ? AND search_version = ?",
+                                   (seq_hash, version)).fetchone()
+                if row is None:
+                    raise KeyError("No hits cached nor searched for contig {}".format(name))
+                lines = row[0].split("\n") if row[0] else []
+            for line in lines:
+                fields = line.split("\t")
+                for column in QSEQID_COLUMNS:
+                    fields[column] = name
+                outhits.write("\t".join(fields) + "\n")
+                written += 1
+    conn.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cache-db", default=DEFAULT_CACHE_DB)
+    subparsers = parser.add_subparsers(dest="command")
+    split = subparsers.add_parser("split", help="write the query shards of the contigs not cached yet")
+    split.add_argument("assembly")
+    split.add_argument("out_dir")
+    split.add_argument("--shards", type=int, default=1)
+    split.add_argument("--db", required=True, help="BLAST database, e.g. the NCBI nt")
+    split.add_argument("--options", default="", help="blastn options, part of the cache key")
+    merge = subparsers.add_parser("merge", help="cache the hits of the shards and write the hit file")
+    merge.add_argument("out_dir")
+    merge.add_argument("output")
+    merge.add_argument("shard_hits", nargs="*")
+    args = parser.parse_args()
+    if args.command == "split":
+        pending = split_assembly(args.assembly, args.out_dir, args.shards, db_version(args.db, args.options),
+                                 args.cache_db)
+        print("{} contigs of {} to search".format(pending, args.assembly))
+    elif args.command == "merge":
+        merge_hits(args.out_dir, args.shard_hits, args.output, args.cache_db)
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Split a BUSCO (v3) lineage into shards and merge the per-shard results.
+
+``split`` writes N lineage directories, each one holding a subset of the BUSCO
+groups of the original lineage (``hmms/``, ``prfl/``, the ancestral sequences
+and the cutoff files are filtered accordingly), so BUSCO can run once per shard
+in parallel. ``merge`` combines the ``full_table`` of every shard and writes the
+``short_summary`` BUSCO would have written for the whole lineage.
+
+Usage:
+    python scripts/busco_shards.py split <lineage_dir> <out_dir> --shards N
+    python scripts/busco_shards.py merge <lineage_dir> <short_summary.txt> <full_table.tsv> <shard_full_table.tsv> [...]
+"""
+import argparse
+import os
+import shutil
+from collections import OrderedDict
+
+from content_cache import link_or_copy
+
+FILTERED_TABLES = ["lengths_cutoff", "scores_cutoff"]
+FILTERED_FASTAS = ["ancestral", "ancestral_variants"]
+GROUP_DIRS = OrderedDict([("hmms", ".hmm"), ("prfl", ".prfl")])
+STATUS_ORDER = ["Complete", "Duplicated", "Fragmented", "Missing"]
+
+
+def read_dataset_cfg(lineage):
+    cfg = OrderedDict()
+    with open(os.path.join(lineage, "dataset.cfg")) as incfg:
+        for line in incfg:
+            if "=" in line:
+                key, value = line.rstrip("\n").split("=", 1)
+                cfg[key] = value
+    return cfg
+
+
+def busco_ids(lineage):
+    return sorted(name[:-len(".hmm")] for name in os.listdir(os.path.join(lineage, "hmms"))
+                  if name.endswith(".hmm"))
+
+
+def filter_fasta(source, destination, ids):
+    """Keep the records whose id (or id without the '_<variant>' suffix) is in ``ids``."""
+    keep = False
+    with open(source) as infasta, open(destination, "w") as outfasta:
+        for line in infasta:
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                keep = name in ids or name.rsplit("_", 1)[0] in ids
+            if keep:
+                outfasta.write(line)
+
+
+def split_lineage(lineage, out_dir, shards):
+    """Write ``shards`` lineage directories named shard_0 ... shard_<N-1> into ``out_dir``."""
+    ids = busco_ids(lineage)
+    cfg = read_dataset_cfg(lineage)
+    for shard in range(shards):
+        shard_ids = set(ids[shard::shards])
+        shard_dir = os.path.join(out_dir, "shard_{}".format(shard))
+        if os.path.exists(shard_dir):
+            shutil.rmtree(shard_dir)
+        for group_dir, suffix in GROUP_DIRS.items():
+            if not os.path.isdir(os.path.join(lineage, group_dir)):
+                continue
+            os.makedirs(os.path.join(shard_dir, group_dir))
+            for busco_id in sorted(shard_ids):
+                source = os.path.join(lineage, group_dir, busco_id + suffix)
+                if os.path.exists(source):
+                    link_or_copy(source, os.path.join(shard_dir, group_dir, busco_id + suffix))
+        for table in FILTERED_TABLES:
+            if os.path.exists(os.path.join(lineage, table)):
+                with open(os.path.join(lineage, table)) as intable, \
+                        open(os.path.join(shard_dir, table), "w") as outtable:
+                    outtable.writelines(line for line in intable if line.split("\t", 1)[0] in shard_ids)
+        for fasta in FILTERED_FASTAS:
+            if os.path.exists(os.path.join(lineage, fasta)):
+                filter_fasta(os.path.join(lineage, fasta), os.path.join(shard_dir, fasta), shard_ids)
+        if os.path.isdir(os.path.join(lineage, "info")):
+            shutil.copytree(os.path.join(lineage, "info"), os.path.join(shard_dir, "info"))
+        shard_cfg = OrderedDict(cfg, number_of_BUSCOs=str(len(shard_ids)))
+        with open(os.path.join(shard_dir, "dataset.cfg"), "w") as outcfg:
+            outcfg.writelines("{}={}\n".format(key, value) for key, value in shard_cfg.items())
+
+
+def read_full_table(path):
+    """(header lines, OrderedDict busco id -> list of rows) of a BUSCO full_table."""
+    header, rows = [], OrderedDict()
+    with open(path) as intable:
+        for line in intable:
+            if line.startswith("#"):
+                header.append(line)
+            elif line.strip():
+                rows.setdefault(line.split("\t", 1)[0], []).append(line)
+    return header, rows
+
+
+def merge_shards(lineage, full_tables, summary_path, table_path):
+    """Write the merged full table and short summary, returns the counts."""
+    header, merged = [], OrderedDict()
+    for full_table in full_tables:
+        shard_header, rows = read_full_table(full_table)
+        header = header or shard_header
+        merged.update(rows)
+    status = {busco_id: rows[0].rstrip("\n").split("\t")[1] for busco_id, rows in merged.items()}
+    # BUSCO groups that no shard reported are counted as missing
+    for busco_id in busco_ids(lineage):
+        if busco_id not in status:
+            status[busco_id] = "Missing"
+            merged[busco_id] = ["{}\tMissing\n".format(busco_id)]
+    with open(table_path, "w") as outtable:
+        outtable.writelines(header)
+        for busco_id in sorted(merged, key=lambda busco_id: (STATUS_ORDER.index(status[busco_id])
+                                                             if status[busco_id] in STATUS_ORDER else 0, busco_id)):
+            outtable.writelines(merged[busco_id])
+
+    total = len(status)
+    counts = OrderedDict((name, sum(1 for value in status.values() if value == name)) for name in STATUS_ORDER)
+    single, duplicated = counts["Complete"], counts["Duplicated"]
+    complete = single + duplicated
+
+    def pct(value):
+        return round(100.0 * value / total, 1) if total else 0.0
+
+    cfg = read_dataset_cfg(lineage)
+    with open(summary_path, "w") as outsummary:
+        outsummary.write("# BUSCO was run in {} shards and merged\n".format(len(full_tables)))
+        outsummary.write("# The lineage dataset is: {} (Creation date: {}, number of species: {}, number of BUSCOs: {})\n".format(
+            cfg.get("name", os.path.basename(os.path.normpath(lineage))), cfg.get("creation_date", "NA"),
+            cfg.get("number_of_species", "NA"), total))
+        outsummary.write("# Merged from: {}\n".format(" ".join(full_tables)))
+        outsummary.write("#\n")
+        outsummary.write("# Summarized benchmarking in BUSCO notation\n")
+        outsummary.write("# BUSCO was run in mode: genome\n\n")
+        outsummary.write("\tC:{}%[S:{}%,D:{}%],F:{}%,M:{}%,n:{}\n\n".format(
+            pct(complete), pct(single), pct(duplicated), pct(counts["Fragmented"]), pct(counts["Missing"]), total))
+        outsummary.write("\t{}\tComplete BUSCOs (C)\n".format(complete))
+        outsummary.write("\t{}\tComplete and single-copy BUSCOs (S)\n".format(single))
+        outsummary.write("\t{}\tComplete and duplicated BUSCOs (D)\n".format(duplicated))
+        outsummary.write("\t{}\tFragmented BUSCOs (F)\n".format(counts["Fragmented"]))
+        outsummary.write("\t{}\tMissing BUSCOs (M)\n".format(counts["Missing"]))
+        outsummary.write("\t{}\tTotal BUSCO groups searched\n".format(total))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    split = subparsers.add_parser("split", help="split a lineage into shards")
+    split.add_argument("lineage")
+    split.add_argument("out_dir")
+    split.add_argument("--shards", type=int, default=1)
+    merge = subparsers.add_parser("merge", help="merge the full tables of the shards")
+    merge.add_argument("lineage")
+    merge.add_argument("summary")
+    merge.add_argument("full_table")
+    merge.add_argument("shard_tables", nargs="+")
+    args = parser.parse_args()
+    if args.command == "split":
+        split_lineage(args.lineage, args.out_dir, args.shards)
+    elif args.command == "merge":
+        merge_shards(args.lineage, args.shard_tables, args.summary, args.full_table)
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""Run pipeline steps inside long-lived containers instead of one container per job.
+
+The first job that needs an image starts a worker container for it (one per
+image, working directory and mount point), with the working directory
+bind-mounted, and every job then ``exec``s its command inside that worker. This
+avoids paying container creation, teardown and image checks once per sample.
+The number of commands running at the same time in a worker is bounded by
+``--max-jobs``. If the worker cannot be started the command falls back to a
+per-job container (``docker run --rm``). Images are never pulled here: they
+must already be present locally (docker) or be given as a local image file
+(singularity), so no network access is needed.
+
+The workers are stopped with ``shutdown``, called from the onsuccess/onerror
+handlers of the Snakefiles. That only reaches the workers of the machine
+running snakemake, so a docker worker also stops itself once it has been idle
+for ``--idle-timeout`` seconds: every job touches a heartbeat file of its
+worker and host (in ``.container_pool``) while its command runs, and the
+worker exits when the file gets older than the timeout. Workers started by
+cluster jobs on other nodes so also stop shortly after the workflow ends.
+Singularity instances are processes of the job that started them and end with
+it on a cluster.
+
+``docker exec`` does not forward signals to the command it runs, so when
+snakemake cancels a job (Ctrl-C, a cluster kill) the SIGTERM or SIGINT is
+caught here: the process group of the command is killed inside the worker
+(every ``docker exec`` starts its command in a new session), and the signal is
+passed on to the docker or singularity client, which stops a per-job container.
+
+Usage:
+    python scripts/container_pool.py run --image <image> --mount /dir [--workdir <dir>] [--user uid:gid] [--idle-timeout 600] -- <command> [args ...]
+    python scripts/container_pool.py shutdown
+"""
+import argparse
+import hashlib
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+from content_cache import FileLock
+
+POOL_DIR = ".container_pool"
+LABEL = "snakemake_pipelines.pool"
+# seconds between two checks of the heartbeat by an idle worker
+IDLE_POLL = 30
+# signals of a cancelled job, passed on to the command running in the worker
+CANCEL_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+def heartbeat_path(name):
+    """Heartbeat file of worker ``name`` on this host, relative to the working directory."""
+    return os.path.join(POOL_DIR, "{}.{}.alive".format(name, socket.gethostname()))
+
+
+def touch(path):
+    with open(path, "a"):
+        os.utime(path, None)
+
+
+class Heartbeat(object):
+    """Touch the heartbeat of a worker every ``interval`` seconds while a command runs in it."""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+
+    def beat(self):
+        while not self.stopped.wait(self.interval):
+            touch(self.path)
+
+    def __enter__(self):
+        touch(self.path)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        touch(self.path)
+
+
+def worker_name(image, mount):
+    digest = hashlib.sha1("\0".join([image, os.getcwd(), mount]).encode()).hexdigest()
+    return "snakepipe-{}".format(digest[:12])
+
+
+class DockerBackend(object):
+
+    def __init__(self, image, mount, image_file=None, idle_timeout=0):
+        self.image = image
+        self.mount = mount
+        self.name = worker_name(image, mount)
+        self.idle_timeout = idle_timeout
+
+    def idle_script(self):
+        """Shell loop of the worker: sleep until the heartbeat is older than the idle timeout."""
+        if not self.idle_timeout:
+            return "exec sleep infinity"
+        heartbeat = shlex.quote("{}/{}".format(self.mount.rstrip("/"), heartbeat_path(self.name)))
+        return ('while [ $(( $(date +%s) - $(date -r {0} +%s 2>/dev/null || echo 0) )) -lt {1} ]; '
+                'do sleep {2}; done'.format(heartbeat, int(self.idle_timeout), IDLE_POLL))
+
+    def running(self):
+        proc = subprocess.run(["docker", "inspect", "-f", "{{.State.Running}}", self.name],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        return proc.returncode == 0 and proc.stdout.strip() == "true"
+
+    def start(self):
+        subprocess.run(["docker", "rm", "-f", self.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        subprocess.run(["docker", "run", "-d", "--name", self.name, "--label", "{}={}".format(LABEL, os.getcwd()),
+                        "-v", "{}:{}".format(os.getcwd(), self.mount), "--entrypoint", "sh", self.image,
+                        "-c", self.idle_script()], check=True, stdout=subprocess.DEVNULL)
+
+    @staticmethod
+    def pid_path(token):
+        """File inside the worker with the pid (and process group) of the command of job ``token``."""
+        return "/tmp/{}.{}.pid".format(POOL_DIR.lstrip("."), token)
+
+    def exec_command(self, command, workdir=None, user=None, token=None):
+        args = ["docker", "exec"]
+        if user:
+            args += ["-u", user]
+        if workdir:
+            args += ["-w", workdir]
+        if token:
+            # the shell leads the process group of the command, its pid is the group to kill
+            pid = shlex.quote(self.pid_path(token))
+            command = ["sh", "-c", 'echo $$ > {0}; "$@"; status=$?; rm -f {0}; exit $status'.format(pid),
+                       "sh"] + command
+        return args + [self.name] + command
+
+    def kill(self, token, wait=5):
+        """Kill the process group of the command of job ``token`` in the worker."""
+        pid = shlex.quote(self.pid_path(token))
+        # the command may not have written its pid yet when the job is cancelled right away
+        script = ('i=0; while [ ! -s {0} ] && [ $i -lt {1} ]; do sleep 1; i=$((i + 1)); done; '
+                  '[ -s {0} ] && kill -KILL -$(cat {0}) 2>/dev/null; rm -f {0}'.format(pid, int(wait)))
+        # as root, the command may run as another user (--user)
+        subprocess.run(["docker", "exec", "-u", "0", self.name, "sh", "-c", script],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def oneshot_command(self, command, workdir=None, user=None):
+        args = ["docker", "run", "--rm", "-v", "{}:{}".format(os.getcwd(), self.mount)]
+        if user:
+            args += ["-u", user]
+        if workdir:
+            args += ["-w", workdir]
+        return args + [self.image] + command
+
+    @staticmethod
+    def shutdown():
+        proc = subprocess.run(["docker", "ps", "-aq", "--filter", "label={}={}".format(LABEL, os.getcwd())],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+        containers = proc.stdout.split()
+        if containers:
+            subprocess.run(["docker", "rm", "-f"] + containers, stdout=subprocess.DEVNULL)
+        return containers
+
+
+class SingularityBackend(object):
+
+    def __init__(self, image, mount, image_file=None, idle_timeout=0):
+        # docker-daemon:// reads the image from the local docker daemon, without network access
+        self.image = image_file or "docker-daemon://{}".format(image)
+        self.mount = mount
+        self.name = worker_name(image, mount).replace("-", "_")
+
+    def running(self):
+        proc = subprocess.run(["singularity", "instance", "list", self.name],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        return proc.returncode == 0 and self.name in proc.stdout
+
+    def start(self):
+        subprocess.run(["singularity", "instance", "start", "-B", "{}:{}".format(os.getcwd(), self.mount),
+                        self.image, self.name], check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(POOL_DIR, "singularity_instances"), "a") as outinstances:
+            outinstances.write(self.name + "\n")
+
+    def exec_command(self, command, workdir=None, user=None, token=None):
+        args = ["singularity", "exec"]
+        if workdir:
+            args += ["--pwd", workdir]
+        return args + ["instance://{}".format(self.name)] + command
+
+    def kill(self, token, wait=5):
+        """Nothing to do: singularity exec passes the signals on to the command itself."""
+
+    def oneshot_command(self, command, workdir=None, user=None):
+        args = ["singularity", "exec", "-B", "{}:{}".format(os.getcwd(), self.mount)]
+        if workdir:
+            args += ["--pwd", workdir]
+        return args + [self.image] + command
+
+    @staticmethod
+    def shutdown():
+        instances_file = os.path.join(POOL_DIR, "singularity_instances")
+        if not os.path.exists(instances_file):
+            return []
+        with open(instances_file) as ininstances:
+            instances = sorted(set(ininstances.read().split()))
+        for instance in instances:
+            subprocess.run(["singularity", "instance", "stop", instance],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        os.remove(instances_file)
+        return instances
+
+
+BACKENDS = {"docker": DockerBackend, "singularity": SingularityBackend}
+
+
+def acquire_slot(name, max_jobs, poll=1.0):
+    """Block until one of the ``max_jobs`` slots of worker ``name`` is free and return its lock."""
+    while True:
+        for slot in range(max_jobs):
+            lock = FileLock(os.path.join(POOL_DIR, "{}.slot{}".format(name, slot)), blocking=False)
+            lock.__enter__()
+            if lock.acquired:
+                return lock
+        time.sleep(poll)
+
+
+def call(args, cancel=None):
+    """subprocess.call of ``args`` that passes SIGTERM and SIGINT on, after ``cancel()`` when it is given.
+
+    Returns 128 + the signal number when the job was cancelled, like a shell.
+    """
+    proc = subprocess.Popen(args)
+    cancelled = []
+
+    def forward(signum, frame):
+        if not cancelled and cancel:
+            cancel()
+        cancelled.append(signum)
+        proc.send_signal(signum)
+
+    previous = {signum: signal.signal(signum, forward) for signum in CANCEL_SIGNALS}
+    try:
+        returncode = proc.wait()
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return 128 + cancelled[0] if cancelled else returncode
+
+
+def run(backend, command, workdir=None, user=None, max_jobs=4, pool=True, idle_timeout=0):
+    os.makedirs(POOL_DIR, exist_ok=True)
+    if not pool:
+        return call(backend.oneshot_command(command, workdir, user))
+    interval = max(1, min(IDLE_POLL, idle_timeout / 4.0)) if idle_timeout else IDLE_POLL
+    # the heartbeat is fresh before the worker is checked, so an idle worker does not exit under the job
+    with Heartbeat(heartbeat_path(backend.name), interval):
+        try:
+            with FileLock(os.path.join(POOL_DIR, backend.name + ".lock")):
+                if not backend.running():
+                    backend.start()
+        except (subprocess.CalledProcessError, OSError) as err:
+            print("Could not start a worker container for {} ({}), running a per-job container".format(
+                backend.image, err), file=sys.stderr)
+            return call(backend.oneshot_command(command, workdir, user))
+        slot = acquire_slot(backend.name, max_jobs)
+        token = uuid.uuid4().hex[:12]
+        try:
+            return call(backend.exec_command(command, workdir, user, token), lambda: backend.kill(token))
+        finally:
+            slot.__exit__(None, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="docker")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="run a command inside the worker of an image")
+    run_parser.add_argument("--image", required=True)
+    run_parser.add_argument("--image-file", help="local singularity image to use instead of the docker daemon")
+    run_parser.add_argument("--mount", default="/dir", help="where the working directory is mounted")
+    run_parser.add_argument("--workdir")
+    run_parser.add_argument("--user")
+    run_parser.add_argument("--max-jobs", type=int, default=4)
+    run_parser.add_argument("--idle-timeout", type=int, default=600,
+                            help="seconds without a running command after which a docker worker stops (0: never)")
+    run_parser.add_argument("--no-pool", dest="pool", action="store_false",
+                            help="always run a per-job container")
+    run_parser.add_argument("cmd", nargs=argparse.REMAINDER)
+    subparsers.add_parser("shutdown", help="stop the workers started from this directory")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        command = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+        if not command:
+            parser.error("missing command to run")
+        backend = BACKENDS[args.backend](args.image, args.mount, args.image_file, args.idle_timeout)
+        sys.exit(run(backend, command, args.workdir, args.user, args.max_jobs, args.pool, args.idle_timeout))
+    elif args.command == "shutdown":
+        stopped = BACKENDS[args.backend].shutdown()
+        print("Stopped {} worker container(s)".format(len(stopped)))
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()
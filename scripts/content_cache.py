@@ -0,0 +1,315 @@
+"""Content-addressed cache shared by the pipelines of this repository.
+
+Expensive results that only depend on the content of an input file (e.g. the
+bowtie2 or minimap2 index of an assembly) are stored once under a cache
+directory, keyed by a hash of the input content, the tool version and the
+arguments used to build them. Jobs of any pipeline, sample or run that ask for
+the same key reuse the stored entry: the files are hard-linked (or copied when
+the cache lives in another filesystem) into the job's output location, so the
+output stays valid even if the entry is later evicted.
+
+Concurrent jobs asking for the same key wait on a file lock while the first one
+builds it. When the cache grows beyond its size limit the least recently used
+entries are removed.
+
+Usage:
+    python scripts/content_cache.py index bowtie2 <assembly.fa> <out_prefix> [--threads N]
+    python scripts/content_cache.py index minimap2 <assembly.fa> <out_prefix> [--preset map-pb]
+    python scripts/content_cache.py quast <assembly.fa> <out_dir> [--threads N] [--no-eukaryote]
+"""
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "snakemake_pipelines")
+DEFAULT_MAX_SIZE = "50G"
+READY = ".ready"
+HASH_BUFSIZE = 4 * 1024 * 1024
+SIZE_SUFFIXES = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+# "<path>/bowtie2-build-s version 2.4.5", "QUAST v5.0.2", "2.24-r1122" (minimap2)
+VERSION_PATTERNS = [re.compile(r"version\s+v?(\d\S*)", re.IGNORECASE), re.compile(r"(?:^|\s)v?(\d[\w.-]*)")]
+
+
+def parse_size(size):
+    """Convert sizes like '50G' or '512m' into bytes."""
+    size = str(size).strip().lower().rstrip("b")
+    suffix = size[-1] if size and size[-1] in SIZE_SUFFIXES else ""
+    number = size[:-1] if suffix else size
+    return int(float(number) * SIZE_SUFFIXES[suffix])
+
+
+def file_digest(path):
+    """sha256 of the content of ``path``, read in fixed size blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(HASH_BUFSIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tool_version(command):
+    """First non-empty output line of ``command`` (e.g. ['bowtie2-build', '--version'])."""
+    proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, check=True)
+    for line in proc.stdout.splitlines():
+        if line.strip():
+            return line.strip()
+    return ""
+
+
+def version_number(line):
+    """The version number in a ``--version`` line, without the path of the binary some tools print.
+
+    The same version installed in two places gives the same number, so the
+    cache keys built with it are shared:
+
+    >>> keys = [ContentCache.make_key("bowtie2", "<digest>", version_number(line))
+    ...         for line in ("/env/a/bin/bowtie2-build-s version 2.4.5", "/opt/b/bowtie2-build-s version 2.4.5")]
+    >>> keys[0] == keys[1]
+    True
+    >>> version_number("QUAST v5.0.2"), version_number("2.24-r1122")
+    ('5.0.2', '2.24-r1122')
+    """
+    for pattern in VERSION_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            return match.group(1)
+    return line
+
+
+def link_or_copy(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, destination)
+
+
+def dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.lstat(os.path.join(dirpath, name)).st_size
+    return total
+
+
+class FileLock(object):
+    """Exclusive ``flock`` on a lock file, usable as a context manager."""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        flags = fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self.fd, flags)
+        except BlockingIOError:
+            os.close(self.fd)
+            self.fd = None
+        return self
+
+    @property
+    def acquired(self):
+        return self.fd is not None
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+class ContentCache(object):
+    """A directory of immutable entries, each one built once per key."""
+
+    def __init__(self, root=None, max_size=DEFAULT_MAX_SIZE):
+        self.root = os.path.abspath(os.path.expanduser(root or DEFAULT_CACHE_DIR))
+        self.max_bytes = parse_size(max_size)
+        self.entries = os.path.join(self.root, "entries")
+        self.locks = os.path.join(self.root, "locks")
+        os.makedirs(self.entries, exist_ok=True)
+        os.makedirs(self.locks, exist_ok=True)
+
+    @staticmethod
+    def make_key(kind, *parts):
+        digest = hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+        return "{}-{}".format(kind, digest[:32])
+
+    def entry_path(self, key):
+        return os.path.join(self.entries, key)
+
+    def lock(self, key, blocking=True):
+        return FileLock(os.path.join(self.locks, key + ".lock"), blocking)
+
+    def get_or_build(self, key, build, use, metadata=None):
+        """Call ``use(entry_dir)`` for ``key``, running ``build(tmpdir)`` first if missing.
+
+        ``build`` must write all the files of the entry inside ``tmpdir``. ``use``
+        runs while the entry is locked, so it cannot be evicted meanwhile.
+        """
+        entry = self.entry_path(key)
+        with self.lock(key):
+            if os.path.exists(os.path.join(entry, READY)):
+                os.utime(os.path.join(entry, READY))
+                use(entry)
+                return entry
+            if os.path.exists(entry):
+                shutil.rmtree(entry)
+            tmpdir = "{}.tmp-{}".format(entry, os.getpid())
+            if os.path.exists(tmpdir):
+                shutil.rmtree(tmpdir)
+            os.makedirs(tmpdir)
+            try:
+                build(tmpdir)
+                with open(os.path.join(tmpdir, "metadata.json"), "w") as outmeta:
+                    json.dump(dict(metadata or {}, key=key, created=time.time()), outmeta, indent=2)
+                open(os.path.join(tmpdir, READY), "w").close()
+                os.rename(tmpdir, entry)
+            except BaseException:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+                raise
+            use(entry)
+        self.evict(keep=key)
+        return entry
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits ``max_bytes``."""
+        with FileLock(os.path.join(self.locks, ".evict.lock")):
+            entries = []
+            for key in os.listdir(self.entries):
+                ready = os.path.join(self.entry_path(key), READY)
+                if ".tmp-" in key or not os.path.exists(ready):
+                    continue
+                entries.append((os.stat(ready).st_mtime, key, dir_size(self.entry_path(key))))
+            total = sum(size for _, _, size in entries)
+            for _, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                # entries being built or read right now are left alone
+                with self.lock(key, blocking=False) as entry_lock:
+                    if not entry_lock.acquired:
+                        continue
+                    shutil.rmtree(self.entry_path(key), ignore_errors=True)
+                total -= size
+
+    @staticmethod
+    def export(entry_prefix, names, out_prefix):
+        """Link each ``entry_prefix + name`` to ``out_prefix + name``."""
+        out_dir = os.path.dirname(out_prefix)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        for name in names:
+            link_or_copy(entry_prefix + name, out_prefix + name)
+
+    @staticmethod
+    def export_tree(entry_dir, out_dir, skip=("metadata.json", READY)):
+        """Link every file below ``entry_dir`` into the same place below ``out_dir``."""
+        for dirpath, _, filenames in os.walk(entry_dir):
+            target = os.path.join(out_dir, os.path.relpath(dirpath, entry_dir))
+            os.makedirs(target, exist_ok=True)
+            for name in filenames:
+                if dirpath == entry_dir and name in skip:
+                    continue
+                link_or_copy(os.path.join(dirpath, name), os.path.join(target, name))
+
+
+def build_bowtie2_index(cache, fasta, out_prefix, threads=1):
+    version = version_number(tool_version(["bowtie2-build", "--version"]))
+    key = cache.make_key("bowtie2", file_digest(fasta), version)
+
+    def build(tmpdir):
+        subprocess.run(["bowtie2-build", "--threads", str(threads), fasta,
+                        os.path.join(tmpdir, "index")], check=True)
+
+    def use(entry):
+        suffixes = [name[len("index"):] for name in sorted(os.listdir(entry)) if name.startswith("index.")]
+        cache.export(os.path.join(entry, "index"), suffixes, out_prefix)
+
+    cache.get_or_build(key, build, use, {"tool": "bowtie2-build", "version": version,
+                                         "source": os.path.abspath(fasta)})
+    return key
+
+
+def build_minimap2_index(cache, fasta, out_prefix, preset="map-pb", threads=1):
+    version = version_number(tool_version(["minimap2", "--version"]))
+    key = cache.make_key("minimap2", file_digest(fasta), version, preset)
+
+    def build(tmpdir):
+        subprocess.run(["minimap2", "-t", str(threads), "-x", preset, "-d",
+                        os.path.join(tmpdir, "index.mmi"), fasta], check=True)
+
+    def use(entry):
+        cache.export(os.path.join(entry, "index"), [".mmi"], out_prefix)
+
+    cache.get_or_build(key, build, use, {"tool": "minimap2", "version": version, "preset": preset,
+                                         "source": os.path.abspath(fasta)})
+    return key
+
+
+def run_quast(cache, fasta, out_dir, threads=1, eukaryote=True):
+    """QUAST report of a single assembly, labelled 'assembly' so it can be shared by any sample."""
+    version = version_number(tool_version(["quast.py", "--version"]))
+    extra = ["--eukaryote"] if eukaryote else []
+    key = cache.make_key("quast", file_digest(fasta), version, *extra)
+
+    def build(tmpdir):
+        subprocess.run(["quast.py", "--labels", "assembly", "--threads", str(threads)] + extra +
+                       ["-o", tmpdir, fasta], check=True)
+
+    def use(entry):
+        cache.export_tree(entry, out_dir)
+
+    cache.get_or_build(key, build, use, {"tool": "quast", "version": version, "options": extra,
+                                         "source": os.path.abspath(fasta)})
+    return key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-size", default=DEFAULT_MAX_SIZE)
+    subparsers = parser.add_subparsers(dest="command")
+    index = subparsers.add_parser("index", help="build (or reuse) an aligner index")
+    index.add_argument("tool", choices=["bowtie2", "minimap2"])
+    index.add_argument("fasta")
+    index.add_argument("out_prefix")
+    index.add_argument("--threads", type=int, default=1)
+    index.add_argument("--preset", default="map-pb", help="minimap2 preset used to build the index")
+    quast = subparsers.add_parser("quast", help="run (or reuse) QUAST on a single assembly")
+    quast.add_argument("fasta")
+    quast.add_argument("out_dir")
+    quast.add_argument("--threads", type=int, default=1)
+    quast.add_argument("--no-eukaryote", dest="eukaryote", action="store_false")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("missing command")
+
+    cache = ContentCache(args.cache_dir, args.max_size)
+    if args.command == "quast":
+        key = run_quast(cache, args.fasta, args.out_dir, args.threads, args.eukaryote)
+        print("QUAST report of {} available in {} (cache entry {})".format(args.fasta, args.out_dir, key))
+        return
+    if args.tool == "bowtie2":
+        key = build_bowtie2_index(cache, args.fasta, args.out_prefix, args.threads)
+    else:
+        key = build_minimap2_index(cache, args.fasta, args.out_prefix, args.preset, args.threads)
+    print("Index of {} available as {} (cache entry {})".format(args.fasta, args.out_prefix, key))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Contig statistics of an assembly, computed with NumPy.
+
+The assembly is read once into arrays of per-contig length, GC count, N count
+and number of N gaps (runs of N). Everything else is computed on the arrays:
+N50/L50, NG50/LG50 (when the genome size is known), whole Nx curves, GC
+content and a length histogram. A samtools ``.fai`` index can be given instead
+of the FASTA, in which case only the length statistics are available. With
+``--fai`` the FASTA is not parsed line by line: every sequence is read in one
+block at the offset given by its index line (an empty index, written for an
+unevenly wrapped FASTA, falls back to the line by line parsing).
+
+As in QUAST, the total length counts every contig, and the other statistics
+only count contigs of at least ``--min-length`` bases (500 by default). So
+``genomesize``, ``contigs``, ``largest`` and ``n50`` match the QUAST report
+rows of the same name.
+
+Usage: python scripts/contig_stats.py <assembly.fa|assembly.fai> <record.json> --sample <name> [--fai assembly.fai] [--genome-size 30m] [--nx-curve nx.tsv] [--histogram histogram.tsv]
+"""
+import argparse
+import csv
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import write_record
+from resource_model import parse_genome_size
+
+MIN_LENGTH = 500
+GC_BYTES = np.array([ord(base) for base in "GCgcSs"])
+N_BYTES = np.array([ord(base) for base in "Nn"])
+# length histogram bins per power of ten
+BINS_PER_DECADE = 4
+
+
+class ContigArrays(object):
+    """Per-contig lengths, GC counts, N counts and N gaps of an assembly (None when read from a .fai)."""
+
+    def __init__(self, names, lengths, gc=None, n_count=None, n_gaps=None):
+        self.names = names
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.gc = None if gc is None else np.asarray(gc, dtype=np.int64)
+        self.n_count = None if n_count is None else np.asarray(n_count, dtype=np.int64)
+        self.n_gaps = None if n_gaps is None else np.asarray(n_gaps, dtype=np.int64)
+
+    @classmethod
+    def from_sequences(cls, sequences):
+        """Arrays of the (name, bytes without line breaks) pairs of ``sequences``."""
+        names, lengths, gc, n_count, n_gaps = [], [], [], [], []
+        for name, sequence in sequences:
+            seq = np.frombuffer(sequence, dtype=np.uint8)
+            counts = np.bincount(seq, minlength=256)
+            is_n = np.isin(seq, N_BYTES)
+            names.append(name)
+            lengths.append(len(seq))
+            gc.append(counts[GC_BYTES].sum())
+            n_count.append(counts[N_BYTES].sum())
+            # a gap starts on every N that does not follow another N
+            n_gaps.append(int(is_n[:1].sum() + np.count_nonzero(is_n[1:] & ~is_n[:-1])))
+        return cls(names, lengths, gc, n_count, n_gaps)
+
+    @classmethod
+    def from_fasta(cls, path):
+        def sequences():
+            name, chunks = None, []
+            with open(path, "rb") as infasta:
+                for line in infasta:
+                    if line.startswith(b">"):
+                        if name is not None:
+                            yield name, b"".join(chunks)
+                        name, chunks = line[1:].split()[0].decode() if line[1:].strip() else "", []
+                    else:
+                        chunks.append(line.rstrip(b"\r\n"))
+            if name is not None:
+                yield name, b"".join(chunks)
+
+        return cls.from_sequences(sequences())
+
+    @classmethod
+    def from_indexed_fasta(cls, path, fai):
+        """Like ``from_fasta``, but every sequence is read in one block at the offset given by ``fai``."""
+        def sequences():
+            with open(path, "rb") as infasta, open(fai) as infai:
+                for line in infai:
+                    name, length, offset, linebases, linewidth = line.split("\t")[:5]
+                    length, linebases, linewidth = int(length), int(linebases), int(linewidth)
+                    full_lines, rest = divmod(length, linebases) if linebases else (0, length)
+                    infasta.seek(int(offset))
+                    block = infasta.read(full_lines * linewidth + rest)
+                    sequence = block.replace(b"\n", b"").replace(b"\r", b"")
+                    if len(sequence) != length:
+                        raise ValueError("{} does not match the index {} at sequence {}".format(path, fai, name))
+                    yield name, sequence
+
+        return cls.from_sequences(sequences())
+
+    @classmethod
+    def from_fai(cls, path):
+        names, lengths = [], []
+        with open(path) as infai:
+            for line in infai:
+                fields = line.split("\t")
+                names.append(fields[0])
+                lengths.append(int(fields[1]))
+        return cls(names, lengths)
+
+    @classmethod
+    def read(cls, path, fai=None):
+        if path.endswith(".fai"):
+            return cls.from_fai(path)
+        # an empty index: the FASTA could not be indexed (uneven line wrapping)
+        if fai and os.path.getsize(fai):
+            return cls.from_indexed_fasta(path, fai)
+        return cls.from_fasta(path)
+
+    def filtered(self, min_length):
+        keep = self.lengths >= min_length
+
+        def subset(values):
+            return None if values is None else values[keep]
+
+        return ContigArrays([name for name, kept in zip(self.names, keep) if kept], self.lengths[keep],
+                            subset(self.gc), subset(self.n_count), subset(self.n_gaps))
+
+
+def nx(lengths, fractions, total=None):
+    """(Nx, Lx) arrays for every fraction in ``fractions`` (0.5 for N50) of ``total``.
+
+    ``total`` defaults to the assembly length; pass the genome size for NGx/LGx.
+    Both are 0 where the contigs do not add up to the fraction of ``total``.
+    """
+    fractions = np.atleast_1d(np.asarray(fractions, dtype=float))
+    if len(lengths) == 0:
+        return np.zeros(len(fractions), dtype=np.int64), np.zeros(len(fractions), dtype=np.int64)
+    sorted_lengths = np.sort(lengths)[::-1]
+    cumulative = np.cumsum(sorted_lengths)
+    total = cumulative[-1] if total is None else total
+    index = np.searchsorted(cumulative, fractions * total, side="left")
+    reached = index < len(sorted_lengths)
+    index = np.minimum(index, len(sorted_lengths) - 1)
+    return np.where(reached, sorted_lengths[index], 0), np.where(reached, index + 1, 0)
+
+
+def nx_curve(lengths, total=None):
+    """Rows (x, Nx, Lx) for x = 0..100."""
+    fractions = np.arange(101) / 100.0
+    values, counts = nx(lengths, fractions, total)
+    return [(x, int(value), int(count)) for x, value, count in zip(range(101), values, counts)]
+
+
+def length_histogram(lengths):
+    """Rows (bin start, bin end, contigs) over log-spaced length bins."""
+    if len(lengths) == 0:
+        return []
+    low = np.floor(np.log10(max(lengths.min(), 1)))
+    high = np.ceil(np.log10(lengths.max() + 1))
+    edges = np.unique(np.floor(10 ** np.arange(low, high + 1.0 / BINS_PER_DECADE, 1.0 / BINS_PER_DECADE)))
+    counts, edges = np.histogram(lengths, bins=edges)
+    return [(int(start), int(end), int(count)) for start, end, count in zip(edges[:-1], edges[1:], counts)]
+
+
+def assembly_stats(contigs, genome_size=None, min_length=MIN_LENGTH):
+    """OrderedDict of the assembly statistics, keyed like the metrics records."""
+    kept = contigs.filtered(min_length)
+    lengths = kept.lengths
+    (n50,), (l50,) = nx(lengths, 0.5)
+    stats = OrderedDict([
+        ("genomesize", int(contigs.lengths.sum())),
+        ("contigs", int(len(lengths))),
+        ("largest", int(lengths.max()) if len(lengths) else 0),
+        ("n50", int(n50)),
+        ("l50", int(l50)),
+        ("total_length", int(lengths.sum())),
+    ])
+    if genome_size:
+        (ng50,), (lg50,) = nx(lengths, 0.5, genome_size)
+        stats["ng50"] = int(ng50) or None
+        stats["lg50"] = int(lg50) or None
+    if kept.gc is not None:
+        acgt = lengths.sum() - kept.n_count.sum()
+        stats["gc"] = round(100.0 * kept.gc.sum() / acgt, 2) if acgt else None
+        stats["n_per_100kbp"] = round(1e5 * kept.n_count.sum() / lengths.sum(), 2) if lengths.sum() else None
+        stats["n_gaps"] = int(kept.n_gaps.sum())
+    return stats
+
+
+def write_tsv(path, header, rows):
+    with open(path, "w", newline="") as outtsv:
+        writer = csv.writer(outtsv, delimiter="\t", lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("assembly", help="FASTA, or .fai for the length statistics only")
+    parser.add_argument("record")
+    parser.add_argument("--sample", required=True)
+    parser.add_argument("--fai", help="samtools index of the FASTA, to read every sequence in one block")
+    parser.add_argument("--genome-size", help="expected genome size for NG50/LG50, e.g. 30m")
+    parser.add_argument("--min-length", type=int, default=MIN_LENGTH)
+    parser.add_argument("--nx-curve", help="write the Nx (and NGx) curve to this TSV")
+    parser.add_argument("--histogram", help="write the contig length histogram to this TSV")
+    args = parser.parse_args()
+
+    genome_size = parse_genome_size(args.genome_size) if args.genome_size else None
+    contigs = ContigArrays.read(args.assembly, args.fai)
+    write_record(args.record, args.sample, "contigs", assembly_stats(contigs, genome_size, args.min_length))
+    lengths = contigs.filtered(args.min_length).lengths
+    if args.nx_curve:
+        rows = nx_curve(lengths)
+        if genome_size:
+            rows = [row + ng[1:] for row, ng in zip(rows, nx_curve(lengths, genome_size))]
+        write_tsv(args.nx_curve, ["x", "Nx", "Lx"] + (["NGx", "LGx"] if genome_size else []), rows)
+    if args.histogram:
+        write_tsv(args.histogram, ["min_length", "max_length", "contigs"], length_histogram(lengths))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Split a genome into balanced chunks for LTR discovery and merge the results back.
+
+``split`` writes N FASTA chunks with about the same number of bases each.
+Contigs are assigned whole, largest first, to the chunk with the fewest bases.
+Contigs longer than ``--window`` are first cut into windows that overlap by
+``--overlap`` bases, so every LTR element shorter than the overlap lies whole
+in at least one window. The map file records where every chunk sequence comes
+from (original sequence and offset).
+
+A genome with fewer pieces than chunks leaves the last chunks empty.
+
+``merge`` reads the LTRharvest (``gt ltrharvest -seqids yes``) and LTR_FINDER
+(``-w 2`` table) outputs of the chunks and moves the coordinates back to the
+original sequences. Every window owns the bases from its start to the start of
+the next window, and only the elements starting in that part are kept, so an
+element of the overlap is reported by one window only (the one where it lies
+whole), even when both windows predict it with slightly different ends. The
+result is written in LTRharvest format (LTR_FINDER predictions are converted
+like LTR_retriever's ``convert_ltr_finder2.pl`` does) so it can be given to
+``LTR_retriever -inharvest``.
+
+Usage:
+    python scripts/ltr_chunks.py split <genome.fa> <out_dir> --chunks N [--window 20000000] [--overlap 20000]
+    python scripts/ltr_chunks.py merge <out_dir>/chunks.map <out.scn> [--harvest chunk.scn ...] [--finder chunk.finder.scn ...]
+"""
+import argparse
+import csv
+import heapq
+import os
+
+LINE_WIDTH = 60
+# LTR_retriever's recommended maximum element length (ltr_finder -D 15000) plus a margin
+DEFAULT_OVERLAP = 20000
+DEFAULT_WINDOW = 20000000
+HARVEST_HEADER = [
+    "# predictions are reported in the following way\n",
+    "# s(ret) e(ret) l(ret) s(lLTR) e(lLTR) l(lLTR) s(rLTR) e(rLTR) l(rLTR) sim(LTRs) seq-nr\n",
+    "# where:\n",
+    "# s = starting position\n",
+    "# e = ending position\n",
+    "# l = length\n",
+    "# ret = LTR-retrotransposon\n",
+    "# lLTR = left LTR\n",
+    "# rLTR = right LTR\n",
+    "# sim = similarity\n",
+    "# seq-nr = sequence name\n",
+]
+
+
+def read_lengths(genome):
+    """List of (name, length) of the sequences of ``genome``."""
+    lengths = []
+    with open(genome) as ingenome:
+        for line in ingenome:
+            if line.startswith(">"):
+                lengths.append([line[1:].split()[0], 0])
+            elif lengths:
+                lengths[-1][1] += len(line.rstrip("\r\n"))
+    return [tuple(item) for item in lengths]
+
+
+def plan_pieces(lengths, window, overlap):
+    """(piece name, sequence name, 0-based start, end) of every piece, long sequences cut in windows."""
+    pieces = []
+    for name, length in lengths:
+        if length <= window:
+            pieces.append((name, name, 0, length))
+            continue
+        start = 0
+        while True:
+            end = min(start + window, length)
+            pieces.append(("{}:{}-{}".format(name, start + 1, end), name, start, end))
+            if end == length:
+                break
+            start = end - overlap
+    return pieces
+
+
+def assign_chunks(pieces, chunks):
+    """Chunk index of every piece, largest pieces first into the chunk with the fewest bases."""
+    heap = [(0, chunk) for chunk in range(chunks)]
+    assignment = {}
+    for piece in sorted(pieces, key=lambda piece: piece[3] - piece[2], reverse=True):
+        bases, chunk = heapq.heappop(heap)
+        assignment[piece[0]] = chunk
+        heapq.heappush(heap, (bases + piece[3] - piece[2], chunk))
+    return assignment
+
+
+def write_sequence(handle, name, sequence):
+    handle.write(">{}\n".format(name))
+    for start in range(0, len(sequence), LINE_WIDTH):
+        handle.write(sequence[start:start + LINE_WIDTH] + "\n")
+
+
+def split_genome(genome, out_dir, chunks, window=DEFAULT_WINDOW, overlap=DEFAULT_OVERLAP):
+    """Write chunk_0.fa ... chunk_<N-1>.fa and chunks.map into ``out_dir``."""
+    if window <= overlap:
+        raise ValueError("The window ({}) must be longer than the overlap ({})".format(window, overlap))
+    pieces = plan_pieces(read_lengths(genome), window, overlap)
+    assignment = assign_chunks(pieces, chunks)
+    pieces_of = {}
+    for piece in pieces:
+        pieces_of.setdefault(piece[1], []).append(piece)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "chunks.map"), "w", newline="") as outmap:
+        writer = csv.writer(outmap, delimiter="\t", lineterminator="\n")
+        writer.writerow(["piece", "sequence", "offset", "length", "chunk"])
+        for piece_name, name, start, end in pieces:
+            writer.writerow([piece_name, name, start, end - start, assignment[piece_name]])
+
+    handles = [open(os.path.join(out_dir, "chunk_{}.fa".format(chunk)), "w") for chunk in range(chunks)]
+    try:
+        with open(genome) as ingenome:
+            name, lines = None, []
+
+            def flush():
+                sequence = "".join(lines)
+                for piece_name, _, start, end in pieces_of.get(name, []):
+                    write_sequence(handles[assignment[piece_name]], piece_name, sequence[start:end])
+
+            for line in ingenome:
+                if line.startswith(">"):
+                    if name is not None:
+                        flush()
+                    name, lines = line[1:].split()[0], []
+                else:
+                    lines.append(line.rstrip("\r\n"))
+            if name is not None:
+                flush()
+    finally:
+        for handle in handles:
+            handle.close()
+    return len(pieces)
+
+
+def read_map(map_path):
+    """{piece: (sequence, offset, end of the part it owns)}, the last window of a sequence owns up to its end."""
+    with open(map_path, newline="") as inmap:
+        rows = [(row["piece"], row["sequence"], int(row["offset"])) for row in csv.DictReader(inmap, delimiter="\t")]
+    starts = {}
+    for _, name, offset in rows:
+        starts.setdefault(name, []).append(offset)
+    pieces = {}
+    for piece_name, name, offset in rows:
+        following = [start for start in starts[name] if start > offset]
+        pieces[piece_name] = (name, offset, min(following) if following else float("inf"))
+    return pieces
+
+
+def harvest_predictions(path):
+    """(starts/ends/lengths as ints, similarity, sequence name) of the LTRharvest predictions of ``path``."""
+    with open(path) as inscn:
+        for line in inscn:
+            fields = line.split()
+            if not fields or line.startswith("#"):
+                continue
+            yield [int(value) for value in fields[:9]], fields[9], fields[10]
+
+
+def finder_predictions(path):
+    """LTR_FINDER ``-w 2`` rows converted to the LTRharvest fields."""
+    with open(path) as inscn:
+        for line in inscn:
+            if not line.startswith("["):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            name, location, ltr_lengths, similarity = fields[1], fields[2], fields[3], fields[15]
+            start, end = (int(value) for value in location.split("-"))
+            left, right = (int(value) for value in ltr_lengths.split(","))
+            positions = [start, end, end - start + 1, start, start + left - 1, left, end - right + 1, end, right]
+            yield positions, "{:.2f}".format(float(similarity) * 100), name
+
+
+def merge_predictions(map_path, out_path, harvest=(), finder=()):
+    """Write the predictions of all chunks on the original sequences, returns how many were written."""
+    pieces = read_map(map_path)
+    seen = set()
+    predictions = []
+    sources = [(path, harvest_predictions) for path in harvest] + [(path, finder_predictions) for path in finder]
+    for path, reader in sources:
+        for positions, similarity, piece_name in reader(path):
+            name, offset, owned_end = pieces.get(piece_name, (piece_name, 0, float("inf")))
+            # lengths (columns 3, 6 and 9) do not move
+            moved = [value if column in (2, 5, 8) else value + offset for column, value in enumerate(positions)]
+            # 1-based start, found again (whole) by the next window when it starts in the overlap
+            if moved[0] - 1 >= owned_end:
+                continue
+            key = (name, tuple(moved))
+            if key in seen:
+                continue
+            seen.add(key)
+            predictions.append((name, moved, similarity))
+    predictions.sort(key=lambda prediction: (prediction[0], prediction[1][0], prediction[1][1]))
+    with open(out_path, "w") as outscn:
+        outscn.writelines(HARVEST_HEADER)
+        for name, moved, similarity in predictions:
+            outscn.write("{} {} {}\n".format(" ".join(str(value) for value in moved), similarity, name))
+    return len(predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    split = subparsers.add_parser("split", help="split the genome into balanced chunks")
+    split.add_argument("genome")
+    split.add_argument("out_dir")
+    split.add_argument("--chunks", type=int, default=1)
+    split.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    split.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP)
+    merge = subparsers.add_parser("merge", help="merge the predictions of the chunks")
+    merge.add_argument("map")
+    merge.add_argument("output")
+    merge.add_argument("--harvest", nargs="*", default=[])
+    merge.add_argument("--finder", nargs="*", default=[])
+    args = parser.parse_args()
+    if args.command == "split":
+        split_genome(args.genome, args.out_dir, args.chunks, args.window, args.overlap)
+    elif args.command == "merge":
+        merge_predictions(args.map, args.output, args.harvest, args.finder)
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()
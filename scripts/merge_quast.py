@@ -0,0 +1,56 @@
+"""Merge single-assembly QUAST reports into one report.tsv.
+
+Each input is the ``report.tsv`` of a QUAST run over a single assembly (see the
+``quast`` command of content_cache.py). The merged table has the same layout as
+the report QUAST writes when it is given all assemblies at once: one row per
+metric and one column per assembly, named after the given labels.
+
+Usage: python scripts/merge_quast.py --labels <name1,name2,...> <out_report.tsv> <report1.tsv> [<report2.tsv> ...]
+"""
+import argparse
+import csv
+from collections import OrderedDict
+
+
+def read_report(path):
+    """Return (header of the first column, OrderedDict metric -> value) of a QUAST report.tsv."""
+    with open(path, newline="") as inreport:
+        rows = list(csv.reader(inreport, delimiter="\t"))
+    metrics = OrderedDict()
+    for row in rows[1:]:
+        if row:
+            metrics[row[0]] = row[1] if len(row) > 1 else ""
+    return rows[0][0], metrics
+
+
+def merge_reports(reports, labels):
+    """Combine ``reports`` (paths) into rows of a table with one column per label."""
+    if len(reports) != len(labels):
+        raise ValueError("Got {} QUAST reports but {} labels".format(len(reports), len(labels)))
+    first_column = "Assembly"
+    metric_names = OrderedDict()
+    columns = []
+    for report in reports:
+        first_column, metrics = read_report(report)
+        for name in metrics:
+            metric_names[name] = None
+        columns.append(metrics)
+    rows = [[first_column] + list(labels)]
+    for name in metric_names:
+        rows.append([name] + [metrics.get(name, "-") for metrics in columns])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--labels", required=True, help="comma separated names, in the order of the reports")
+    parser.add_argument("output")
+    parser.add_argument("reports", nargs="+")
+    args = parser.parse_args()
+    rows = merge_reports(args.reports, args.labels.split(","))
+    with open(args.output, "w", newline="") as outreport:
+        csv.writer(outreport, delimiter="\t", lineterminator="\n").writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Per-sample metrics records written by the evaluation rules.
+
+Every evaluation rule turns the raw output of its tool into a small JSON record
+as soon as it finishes::
+
+    {"sample": "Sample1", "tool": "busco", "metrics": {"pctcomplete": 98.6, ...}}
+
+The report only reads these records. ``aggregate`` keeps a cache of the
+combined records (keyed by path, size and modification time) so re-rendering
+the report only opens the records that changed since the last aggregation.
+
+Usage: python scripts/metrics.py <busco|ale|reapr|lai> <raw_output> <record.json> --sample <name>
+"""
+import argparse
+import json
+import os
+import re
+from collections import OrderedDict
+
+
+def to_number(value):
+    """int or float out of a report value, None when it is not a number (e.g. '-')."""
+    value = str(value).replace(",", "").strip()
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def parse_busco(out_short_summary):
+    """Numbers and percentages of a BUSCO short_summary file."""
+    dict_busco = OrderedDict()
+    counts = OrderedDict([
+        ("Complete BUSCOs", "ncomplete"),
+        ("Complete and single-copy BUSCOs", "nsingle"),
+        ("Complete and duplicated BUSCOs", "nduplicated"),
+        ("Fragmented BUSCOs", "nfragmented"),
+        ("Missing BUSCOs", "nmissing"),
+    ])
+    with open(out_short_summary, 'r') as infbusco:
+        for line in infbusco:
+            if line.startswith("#"):
+                continue
+            match_summary_obj = re.match(r'\s+C\:(\d+.\d+)\%\[S\:(\d+.\d)\%,D\:(\d+.\d+)\%\],F\:(\d+.\d+)\%,M:(\d+.\d+)%,n:\d+', line)
+            if match_summary_obj:
+                dict_busco['pctcomplete'] = float(match_summary_obj.group(1))
+                dict_busco['pctsingle'] = float(match_summary_obj.group(2))
+                dict_busco['pctduplicated'] = float(match_summary_obj.group(3))
+                dict_busco['pctfragmented'] = float(match_summary_obj.group(4))
+                dict_busco['pctmissing'] = float(match_summary_obj.group(5))
+                continue
+            match_n = re.match(r'\s+(\d+)\s+(.+?)\s+\([CSDFM]\)', line)
+            if match_n and match_n.group(2) in counts:
+                dict_busco[counts[match_n.group(2)]] = int(match_n.group(1))
+    return dict_busco
+
+
+def parse_ale(ale_output):
+    """ALE score from the header of ALEoutput.txt."""
+    with open(ale_output) as inale:
+        for line in inale:
+            match_score = re.match(r'#\sALE_score:\s(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)', line)
+            if match_score:
+                return {'ale': float(match_score.group(1))}
+    return {'ale': None}
+
+
+def parse_reapr(summary_report):
+    """Error counts from REAPR 05.summary.report.txt."""
+    dict_reapr = OrderedDict()
+    with open(summary_report) as infreapr:
+        for line in infreapr:
+            match_errors = re.match(r'^(\d+)\serrors.$', line)
+            if match_errors:
+                dict_reapr['reapr_total_errors'] = int(match_errors.group(1))
+            match_fcd_errors = re.match(r'FCD errors within a contig:\s(\d+)', line)
+            if match_fcd_errors:
+                dict_reapr['reapr_fcd'] = int(match_fcd_errors.group(1))
+            match_low_frag_cov = re.match(r'Low fragment coverage within a contig:\s(\d+)', line)
+            if match_low_frag_cov:
+                dict_reapr['reapr_low'] = int(match_low_frag_cov.group(1))
+    return dict_reapr
+
+
+def parse_lai(lai_file):
+    """Whole genome LTR Assembly Index from LTR_retriever's .LAI file."""
+    with open(lai_file) as inlai:
+        for line in inlai:
+            if line.startswith("whole_genome"):
+                return {'lai': to_number(line.rstrip("\n").split("\t")[-1])}
+    return {'lai': None}
+
+
+PARSERS = OrderedDict([
+    ("busco", parse_busco),
+    ("ale", parse_ale),
+    ("reapr", parse_reapr),
+    ("lai", parse_lai),
+])
+
+
+def write_record(path, sample, tool, metrics):
+    record = OrderedDict([("sample", sample), ("tool", tool), ("metrics", metrics)])
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as outrecord:
+        json.dump(record, outrecord, indent=2)
+    os.replace(tmp_path, path)
+
+
+def aggregate(record_paths, cache_path):
+    """Merge the records of ``record_paths`` into an OrderedDict sample -> metrics.
+
+    Records whose size and modification time did not change since the previous
+    call are taken from ``cache_path`` instead of being read again.
+    """
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as incache:
+            cache = json.load(incache)
+    new_cache = {}
+    samples = OrderedDict()
+    for path in record_paths:
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = cache.get(path)
+        if cached is not None and cached["signature"] == signature:
+            record = cached["record"]
+        else:
+            with open(path) as inrecord:
+                record = json.load(inrecord, object_pairs_hook=OrderedDict)
+        new_cache[path] = {"signature": signature, "record": record}
+        samples.setdefault(record["sample"], OrderedDict()).update(record["metrics"])
+    cache_dir = os.path.dirname(cache_path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path + ".tmp", "w") as outcache:
+        json.dump(new_cache, outcache)
+    os.replace(cache_path + ".tmp", cache_path)
+    return samples
+
+
+def metrics_table(record_paths, cache_path, columns=None):
+    """pandas DataFrame with one row per sample ('name' column) out of the records."""
+    import pandas as pd
+
+    samples = aggregate(record_paths, cache_path)
+    table = pd.DataFrame.from_records(
+        [OrderedDict([("name", sample)] + list(metrics.items())) for sample, metrics in samples.items()])
+    if columns is not None:
+        table = table.reindex(columns=["name"] + list(columns))
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("tool", choices=list(PARSERS))
+    parser.add_argument("raw_output")
+    parser.add_argument("record")
+    parser.add_argument("--sample", required=True)
+    args = parser.parse_args()
+    write_record(args.record, args.sample, args.tool, PARSERS[args.tool](args.raw_output))
+
+
+if __name__ == "__main__":
+    main()
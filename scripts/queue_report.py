@@ -0,0 +1,93 @@
+"""Queue time of the cluster jobs of a run, and the queue time saved by the rule groups.
+
+Reads the log written by the submit command of the profiles
+(``profiles/cluster/submit.py``): for every submission, the time it was
+submitted, started and finished, and the rule of every job it ran. A group
+submission runs several jobs but waits in the queue (and parses the Snakefile)
+only once. So every job it bundles beyond the first saves one average queue
+wait and one Snakefile parse. The jobs of a group are listed by snakemake 7 and
+later; with older versions each rule of a group counts as one job.
+
+The table of the submissions is written to ``<out.tsv>`` and a summary is
+printed.
+
+Usage: python scripts/queue_report.py .snakemake/cluster_queue.tsv <out.tsv>
+"""
+import argparse
+import csv
+import statistics
+
+FIELDS = ["token", "event", "time", "group", "rules", "detail"]
+
+
+def read_submissions(log):
+    """One dict per submission with its times (None when not seen yet), rule of every job, group and job id."""
+    submissions = {}
+    with open(log, newline="") as inlog:
+        for row in csv.reader(inlog, delimiter="\t"):
+            if len(row) < len(FIELDS):
+                continue
+            entry = dict(zip(FIELDS, row))
+            submission = submissions.setdefault(entry["token"], {"token": entry["token"], "submitted": None,
+                                                                 "started": None, "finished": None, "group": "",
+                                                                 "rules": [], "job_id": "", "host": ""})
+            submission[entry["event"]] = float(entry["time"])
+            if entry["event"] == "submitted":
+                submission.update(group=entry["group"], rules=[rule for rule in entry["rules"].split(",") if rule],
+                                  job_id=entry["detail"])
+            elif entry["event"] == "started":
+                submission["host"] = entry["detail"]
+    return sorted(submissions.values(), key=lambda submission: submission["submitted"] or 0)
+
+
+def summarize(submissions):
+    """Queue totals of the submissions that started, and the estimate of what the groups saved."""
+    started = [submission for submission in submissions if submission["submitted"] and submission["started"]]
+    waits = [submission["started"] - submission["submitted"] for submission in started]
+    jobs = sum(max(1, len(submission["rules"])) for submission in started)
+    mean_wait = statistics.mean(waits) if waits else 0.0
+    grouped = [submission for submission in started if submission["group"]]
+    return {
+        "submissions": len(started),
+        "jobs": jobs,
+        "group_submissions": len(grouped),
+        "queue_s": round(sum(waits), 1),
+        "mean_wait_s": round(mean_wait, 1),
+        "median_wait_s": round(statistics.median(waits), 1) if waits else 0.0,
+        # the bundled jobs would have waited on their own without the groups
+        "submissions_saved": jobs - len(started),
+        "queue_saved_s": round((jobs - len(started)) * mean_wait, 1),
+    }
+
+
+def write_table(submissions, output):
+    with open(output, "w", newline="") as outtsv:
+        writer = csv.writer(outtsv, delimiter="\t", lineterminator="\n")
+        writer.writerow(["job_id", "group", "jobs", "rules", "wait_s", "run_s", "host"])
+        for submission in submissions:
+            wait = run = ""
+            if submission["submitted"] and submission["started"]:
+                wait = round(submission["started"] - submission["submitted"], 1)
+            if submission["started"] and submission["finished"]:
+                run = round(submission["finished"] - submission["started"], 1)
+            rules = submission["rules"]
+            writer.writerow([submission["job_id"], submission["group"], len(rules),
+                             ",".join(sorted(set(rules), key=rules.index)), wait, run, submission["host"]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("log")
+    parser.add_argument("output")
+    args = parser.parse_args()
+    submissions = read_submissions(args.log)
+    write_table(submissions, args.output)
+    summary = summarize(submissions)
+    print("{jobs} jobs in {submissions} submissions ({group_submissions} groups), {queue_s}s in the queue "
+          "(mean {mean_wait_s}s, median {median_wait_s}s per submission)".format(**summary))
+    print("Groups saved {submissions_saved} submissions and Snakefile parses, about {queue_saved_s}s "
+          "of queue time".format(**summary))
+
+
+if __name__ == "__main__":
+    main()
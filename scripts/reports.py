@@ -0,0 +1,87 @@
+"""Reports of the evaluation pipelines, built from the per-sample metrics records.
+
+The functions are called from the ``run:`` blocks of the report rules. pandas
+and jinja2 are only imported when a report is built, so parsing a Snakefile
+(which snakemake does again for every job) does not pay for them.
+"""
+import os
+from collections import OrderedDict
+
+from metrics import metrics_table
+
+# column titles of results.csv/results.xlsx of evaluate_assemblies, in the order of REPORT_COLUMNS
+EVALUATE_TITLES = ['Assembly', 'ALE score (neglog)', 'REAPR erros', 'REAPR fcd', 'REAPR low', 'Assembly length',
+                   'contigs', 'N50', 'Largest contig', 'BUSCO complete (%)', 'BUSCO single (%)',
+                   'BUSCO duplicated (%)', 'BUSCO fragmented (%)', 'BUSCO missing (%)', 'BUSCO complete',
+                   'BUSCO single', 'BUSCO duplicated', 'BUSCO fragmented', 'BUSCO missing', 'ALE normalized']
+# quick look at the assemblies: every column with a value gets a color scale
+PREVIEW_GRADIENT = ['contigs', 'n50', 'largest']
+
+
+def existing(paths):
+    """The records of ``paths`` that were already written (for the optional or unfinished tools)."""
+    return [record for record in paths if os.path.exists(record)]
+
+
+def heatmap_html(table, columns):
+    """HTML of ``table`` without index, colored per column of ``columns``."""
+    return table.style.hide_index().background_gradient('viridis', axis=0, subset=list(columns)).render()
+
+
+def render_template(template_path, items):
+    import jinja2
+
+    loader = jinja2.FileSystemLoader(template_path)
+    env = jinja2.Environment(loader=loader)
+    return env.get_template('').render(items=items)
+
+
+def evaluate_report(record_paths, cache_path, columns, template_path, out_dir):
+    """results.html, results_heat.html, results.xlsx and results.csv of evaluate_assemblies into ``out_dir``."""
+    import pandas as pd
+
+    df = metrics_table(record_paths, cache_path, columns)
+    # min-max normalization
+    ale = df['ale']
+    df['ale_norm'] = ((ale - ale.min()) / (ale.max() - ale.min())).round(2)
+
+    df_sub_sorted = pd.DataFrame(OrderedDict([
+        ('Assembly', df['name']),
+        ('Genome Size (bp)', df['genomesize']),
+        ('Number of Contigs', df['contigs']),
+        ('N50', df['n50']),
+        ('Largest Contig (bp)', df['largest']),
+        ('BUSCO Complete Genes (%)', df['pctcomplete']),
+        ('BUSCO Single-Copy Genes (%)', 100. - df['pctduplicated']),
+        ('BUSCO Non-fragmented Genes (%)', 100. - df['pctfragmented']),
+        ('BUSCO Found Genes (%)', 100. - df['pctmissing'])])).sort_values('Assembly')
+    with open(os.path.join(out_dir, 'results_heat.html'), 'w') as fheat:
+        fheat.write(heatmap_html(df_sub_sorted, df_sub_sorted.columns[1:]))
+
+    res_items = df.where(df.notnull(), 'X').to_dict('records')
+    for item in res_items:
+        item.update({'{}_class'.format(key): "tg-lboi" for key in list(item)})
+    with open(os.path.join(out_dir, 'results.html'), 'w') as outfile:
+        outfile.write(render_template(template_path, res_items))
+    c = df.copy()
+    c.columns = EVALUATE_TITLES
+    c.to_excel(os.path.join(out_dir, 'results.xlsx'), index=False)
+    c.to_csv(os.path.join(out_dir, 'results.csv'), index=False)
+
+
+def plants_report(record_paths, cache_path, columns, template_path, output):
+    """results.html of evaluate_assemblies_plants."""
+    df = metrics_table(record_paths, cache_path, columns)
+    for column in ['genomesize', 'contigs', 'n50', 'largest']:
+        df[column] = df[column].map('{:,.0f}'.format, na_action='ignore')
+    items = df.where(df.notnull(), 'X').to_dict('records')
+    with open(output, 'w') as outfile:
+        outfile.write(render_template(template_path, items))
+
+
+def preview_report(record_paths, cache_path, columns, html, csv_path):
+    """preview.html and preview.csv: one row per assembly with the metrics available so far."""
+    df = metrics_table(record_paths, cache_path, columns).sort_values('name')
+    df.to_csv(csv_path, index=False)
+    with open(html, 'w') as fpreview:
+        fpreview.write(heatmap_html(df, PREVIEW_GRADIENT))
@@ -0,0 +1,164 @@
+"""Memory, thread and disk estimates of the pipeline steps, for the ``threads`` and ``resources`` of the rules.
+
+Every tool has a small linear model of its peak memory and of the disk space
+it writes, in terms of the genome size (the expected genome size for the
+assemblers, the assembly size for the evaluation tools), the size of the reads
+and the number of threads. The numbers are rough upper bounds taken from the
+published requirements of each tool (e.g. Flye needs ~450 GB for a 3 Gbp human
+genome, wtdbg2 ~250 GB), so snakemake can run several jobs side by side
+(``--resources mem_mb=<node memory>``) without overcommitting the memory.
+
+The number of threads of a tool is estimated the same way: one thread per
+slice of genome and of reads a tool keeps busy, at most the threads the tool
+scales to and the ``threads`` of the configuration. Small genomes and read sets
+so take a few threads, and snakemake runs several of their jobs side by side.
+
+A job that fails is restarted with a larger budget when snakemake is given
+``--restart-times``: the estimate is multiplied by the attempt number. No
+estimate is larger than the ``memory`` of the configuration; a job that already
+had the whole of it and failed is not restarted with the same budget, its
+memory estimate raises ``MemoryBudgetExceeded`` instead.
+"""
+import math
+import os
+from collections import namedtuple
+
+from content_cache import parse_size
+
+# peak memory: base_mb + per_mbp * genome Mbp + per_read_mb * reads MB + per_thread_mb * threads
+# disk written: disk_per_mbp * genome Mbp + disk_per_read_mb * reads MB
+ToolModel = namedtuple("ToolModel", ["base_mb", "per_mbp", "per_read_mb", "per_thread_mb",
+                                     "disk_per_mbp", "disk_per_read_mb"])
+
+MODELS = {
+    "flye": ToolModel(2000, 150, 0, 0, 10, 3),
+    "wtdbg2": ToolModel(2000, 80, 0, 0, 5, 1.5),
+    "wtdbg2_consensus": ToolModel(1000, 10, 0, 100, 2, 0),
+    "ra": ToolModel(2000, 0, 1.5, 0, 2, 0.5),
+    "bowtie2_build": ToolModel(500, 4, 0, 0, 4, 0),
+    "bowtie2": ToolModel(500, 1.5, 0, 50, 0, 1),
+    "minimap2_index": ToolModel(1000, 4, 0, 0, 4, 0),
+    "minimap2": ToolModel(2000, 4, 0, 50, 0, 1),
+    "ale": ToolModel(1000, 3, 0, 0, 1, 0),
+    "reapr": ToolModel(2000, 4, 0, 0, 2, 0.5),
+    "busco": ToolModel(2000, 1, 0, 500, 5, 0),
+    "quast": ToolModel(1000, 2, 0, 0, 1, 0),
+    # hashes and lengths of the contigs, the shards hold at most the whole assembly
+    "blast_split": ToolModel(500, 0.1, 0, 0, 1, 0),
+}
+# threads kept busy: one per mbp_per_thread Mbp of genome plus one per read_mb_per_thread MB of reads
+# (0: the size does not count), at most max_threads (0: no limit of the tool)
+ThreadModel = namedtuple("ThreadModel", ["max_threads", "mbp_per_thread", "read_mb_per_thread"])
+
+THREAD_MODELS = {
+    "flye": ThreadModel(0, 1, 0),
+    "wtdbg2": ThreadModel(0, 1, 0),
+    "wtdbg2_consensus": ThreadModel(0, 0.5, 0),
+    "ra": ThreadModel(0, 0, 100),
+    "bowtie2_build": ThreadModel(0, 10, 0),
+    "bowtie2": ThreadModel(0, 0, 100),
+    # minimap2 builds the index with at most 3 threads
+    "minimap2_index": ThreadModel(3, 0, 0),
+    "minimap2": ThreadModel(0, 0, 100),
+    "ale": ThreadModel(1, 0, 0),
+    "reapr": ThreadModel(1, 0, 0),
+    "busco": ThreadModel(0, 1, 0),
+    "quast": ThreadModel(0, 5, 0),
+    "blast_split": ThreadModel(1, 0, 0),
+}
+# gzipped reads take about this many times their file size once decompressed
+GZIP_RATIO = 3
+# samtools sort uses somewhat more than -m per thread
+SORT_OVERHEAD = 1.2
+MB = 1024 ** 2
+GENOME_SIZE_SUFFIXES = {"": 1, "k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9}
+
+Estimate = namedtuple("Estimate", ["mem_mb", "disk_mb"])
+
+
+class MemoryBudgetExceeded(ValueError):
+    """A job failed with the whole memory budget, a restart would get the same budget."""
+
+
+def parse_genome_size(size):
+    """Number of bases of a genome size like wtdbg2/flye take it ('30m', '4.6M', '3g')."""
+    size = str(size).strip().lower()
+    suffix = size[-1] if size and size[-1] in GENOME_SIZE_SUFFIXES else ""
+    return int(float(size[:-1] if suffix else size) * GENOME_SIZE_SUFFIXES[suffix])
+
+
+def parse_memory_mb(memory):
+    """MB out of a memory size like '100g', None when no memory was configured."""
+    if memory is None or str(memory).strip() == "":
+        return None
+    return parse_size(memory) // MB
+
+
+def data_size(paths):
+    """Uncompressed size in bytes of the files in ``paths`` (missing files count as 0)."""
+    total = 0
+    for path in paths:
+        if path and os.path.exists(path):
+            total += os.path.getsize(path) * (GZIP_RATIO if str(path).endswith(".gz") else 1)
+    return total
+
+
+def threads(tool, genome_size=0, reads_bytes=0, max_threads=1):
+    """Number of threads worth giving to ``tool``, between 1 and ``max_threads``."""
+    model = THREAD_MODELS[tool]
+    if model.mbp_per_thread or model.read_mb_per_thread:
+        wanted = 0
+        if model.mbp_per_thread:
+            wanted += genome_size / 1e6 / model.mbp_per_thread
+        if model.read_mb_per_thread:
+            wanted += reads_bytes / MB / model.read_mb_per_thread
+        count = min(max_threads, int(math.ceil(wanted)))
+    else:
+        count = max_threads
+    if model.max_threads:
+        count = min(count, model.max_threads)
+    return max(1, count)
+
+
+def estimate(tool, genome_size=0, reads_bytes=0, threads=1, attempt=1, max_mem_mb=None, extra_mb=0):
+    """Estimate(mem_mb, disk_mb) of running ``tool``; the memory grows with the attempt number."""
+    model = MODELS[tool]
+    genome_mbp = genome_size / 1e6
+    reads_mb = reads_bytes / MB
+    mem_mb = (model.base_mb + model.per_mbp * genome_mbp + model.per_read_mb * reads_mb
+              + model.per_thread_mb * threads + extra_mb)
+    if max_mem_mb and attempt > 1 and mem_mb * (attempt - 1) >= max_mem_mb:
+        raise MemoryBudgetExceeded(
+            "{} failed on attempt {} with the whole memory budget ({} MB); raise `memory` in the "
+            "configuration to restart it with more".format(tool, attempt - 1, max_mem_mb))
+    mem_mb *= attempt
+    if max_mem_mb:
+        mem_mb = min(mem_mb, max_mem_mb)
+    disk_mb = model.disk_per_mbp * genome_mbp + model.disk_per_read_mb * reads_mb
+    return Estimate(int(math.ceil(mem_mb)), int(math.ceil(disk_mb)) + 100)
+
+
+def sort_memory_per_thread_mb(reads_bytes, threads, max_mem_mb=None, minimum=256, maximum=4096):
+    """Memory of each samtools sort thread (-m), enough to sort the alignments of the reads in memory.
+
+    Each thread gets its share of the reads size, between ``minimum`` and
+    ``maximum`` MB, and all the threads together use at most half of ``max_mem_mb``.
+    """
+    per_thread = max(minimum, min(maximum, int(reads_bytes / MB / max(threads, 1))))
+    if max_mem_mb:
+        per_thread = max(minimum, min(per_thread, int(max_mem_mb / 2 / max(threads, 1))))
+    return per_thread
+
+
+def sort_memory_mb(per_thread_mb, threads):
+    """Memory used by samtools sort with ``threads`` threads of ``per_thread_mb`` each."""
+    return int(math.ceil(per_thread_mb * threads * SORT_OVERHEAD))
+
+
+def sort_setting(reads_bytes, threads, max_mem_mb=None, configured=None):
+    """(samtools sort -m value, MB used by the whole sort); ``configured`` (e.g. '4G') overrides the estimate."""
+    if configured:
+        per_thread_mb = parse_size(configured) // MB
+        return str(configured), sort_memory_mb(per_thread_mb, threads)
+    per_thread_mb = sort_memory_per_thread_mb(reads_bytes, threads, max_mem_mb)
+    return "{}M".format(per_thread_mb), sort_memory_mb(per_thread_mb, threads)
@@ -0,0 +1,51 @@
+"""Lightweight reader of the samples table (samples.tsv) of the pipelines.
+
+snakemake parses the whole Snakefile again for every job it runs (and for every
+``snakemake -n``), so the Snakefiles only read the samples table with the csv
+module instead of importing pandas. ``SampleTable`` offers the two lookups the
+Snakefiles need: the values of a column in the order of the table, and the
+value of one column for one sample.
+"""
+import csv
+from collections import OrderedDict
+
+
+class SampleTable(object):
+    """Rows of a tab-separated table with a header, indexed by the ``index`` column."""
+
+    def __init__(self, rows, columns, index="sample"):
+        self.columns = list(columns)
+        if index not in self.columns:
+            raise ValueError("The samples table has no '{}' column".format(index))
+        self.index = index
+        self.rows = OrderedDict()
+        for row in rows:
+            if row[index] in self.rows:
+                raise ValueError("Sample {} appears twice in the samples table".format(row[index]))
+            self.rows[row[index]] = row
+
+    @classmethod
+    def read(cls, path, index="sample"):
+        with open(path, newline="") as intable:
+            # blank lines are skipped, as pandas.read_table does
+            lines = [line for line in intable if line.strip()]
+        reader = csv.DictReader(lines, delimiter="\t")
+        rows = [{key: (value or "").strip() for key, value in row.items() if key is not None} for row in reader]
+        return cls(rows, [column.strip() for column in reader.fieldnames or []], index)
+
+    def __getitem__(self, column):
+        """Values of ``column`` in the order of the table, e.g. ``samples['sample']`` for ``expand``."""
+        if column not in self.columns:
+            raise KeyError(column)
+        return [row[column] for row in self.rows.values()]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def value(self, sample, column):
+        """Value of ``column`` for ``sample``."""
+        return self.rows[sample][column]
+
+
+def read_samples(path, index="sample"):
+    return SampleTable.read(path, index)
@@ -0,0 +1,127 @@
+"""Time it takes snakemake to parse a pipeline and build its DAG, for growing numbers of samples.
+
+For every sample count, a scratch working directory is filled with that many
+tiny assemblies (or read files for the assembler pipelines), a samples table
+and a configuration. ``snakemake -n`` (a dry run, which parses the Snakefile
+and builds the whole DAG, as every job on a cluster does before it starts) is
+then timed ``--repeat`` times. The median is reported per sample count, along
+with the time of importing the modules shared by the Snakefiles.
+
+Usage: python scripts/startup_benchmark.py [--pipeline evaluate_assemblies] [--samples 10 100 1000] [--repeat 3] [--output startup.tsv]
+"""
+import argparse
+import csv
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SNAKEFILES = {
+    "evaluate_assemblies": "Snakefile_evaluate.py",
+    "evaluate_assemblies_plants": "Snakefile_evaluate",
+    "ont_assemblers": "Snakefile_ont_assembler",
+    "pacbio_assemblers": "Snakefile_pacbio_assembler",
+}
+# the file each Snakefile reads its configuration from
+CONFIG_FILES = {"evaluate_assemblies_plants": "config_evaluate.yaml"}
+SHARED_MODULES = ["metrics", "reports", "resource_model", "sample_table", "subsample_reads", "telemetry"]
+TINY_FASTA = ">contig_1\nACGTACGTACGTACGTACGT\n"
+TINY_FASTQ = "@read_1\nACGTACGTACGTACGTACGT\n+\nIIIIIIIIIIIIIIIIIIII\n"
+
+
+def write(path, content):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as outfile:
+        outfile.write(content)
+
+
+def make_workdir(workdir, pipeline, samples):
+    """Write the inputs, samples table and configuration of ``samples`` samples into ``workdir``."""
+    names = ["Sample{}".format(number) for number in range(1, samples + 1)]
+    if pipeline in ("ont_assemblers", "pacbio_assemblers"):
+        rows = [(name, "reads/{}.fastq".format(name)) for name in names]
+        header, config = ("sample", "raw_fastq"), "genome_size: 30m\nmemory: 100g\n"
+        for _, reads in rows:
+            write(os.path.join(workdir, reads), TINY_FASTQ)
+    else:
+        rows = [(name, "assemblies/{}.fa".format(name)) for name in names]
+        header = ("sample", "assembly")
+        for _, assembly in rows:
+            write(os.path.join(workdir, assembly), TINY_FASTA)
+        if pipeline == "evaluate_assemblies":
+            config = ("fq1: fastq/reads_1.fastq\nfq2: fastq/reads_2.fastq\n"
+                      "lineage: dataset/lineage\nspecies_augustus: None\n")
+            write(os.path.join(workdir, "fastq/reads_1.fastq"), TINY_FASTQ)
+            write(os.path.join(workdir, "fastq/reads_2.fastq"), TINY_FASTQ)
+            write(os.path.join(workdir, "config.ini.default"), "")
+        else:
+            config = ("fq: fastq/long_reads.fastq\nlineage: dataset/lineage\nspecies_augustus: None\n"
+                      "BUSCO_PATH: busco\nLTR_RETRIEVE_PATH: ltr_retriever\nNCBI_NT_DB: nt\n")
+            write(os.path.join(workdir, "fastq/long_reads.fastq"), TINY_FASTQ)
+    with open(os.path.join(workdir, "samples.tsv"), "w", newline="") as outsamples:
+        writer = csv.writer(outsamples, delimiter="\t", lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+    write(os.path.join(workdir, CONFIG_FILES.get(pipeline, "config.yaml")),
+          'workdir: "."\nsamples: samples.tsv\nthreads: 4\n' + config)
+
+
+def time_dry_run(snakemake, snakefile, workdir):
+    """Seconds of ``snakemake -n`` in ``workdir``."""
+    start = time.perf_counter()
+    proc = subprocess.run(snakemake + ["-s", snakefile, "-n", "--quiet"], cwd=workdir, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError("snakemake -n failed in {}:\n{}".format(workdir, proc.stdout[-2000:]))
+    return elapsed
+
+
+def time_imports(modules):
+    """Seconds of importing ``modules`` in a fresh interpreter, as a Snakefile does."""
+    code = "import sys, time; sys.path.insert(0, {!r}); start = time.perf_counter(); import {}; print(time.perf_counter() - start)"
+    proc = subprocess.run([sys.executable, "-c", code.format(os.path.join(REPO_DIR, "scripts"), ", ".join(modules))],
+                          stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return float(proc.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pipeline", choices=sorted(SNAKEFILES), default="evaluate_assemblies")
+    parser.add_argument("--samples", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--snakemake", default="snakemake", help="snakemake command, e.g. 'python -m snakemake'")
+    parser.add_argument("--output", help="also write the timings to this TSV")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch working directories")
+    args = parser.parse_args()
+
+    snakefile = os.path.join(REPO_DIR, args.pipeline, SNAKEFILES[args.pipeline])
+    snakemake = args.snakemake.split()
+    rows = [("imports", "", round(time_imports(SHARED_MODULES), 3), "")]
+    print("shared modules imported in {:.3f}s".format(rows[0][2]))
+    for samples in args.samples:
+        workdir = tempfile.mkdtemp(prefix="startup_{}_".format(samples))
+        try:
+            make_workdir(workdir, args.pipeline, samples)
+            timings = [time_dry_run(snakemake, snakefile, workdir) for _ in range(args.repeat)]
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        median = statistics.median(timings)
+        rows.append(("dag", samples, round(median, 3), round(max(timings), 3)))
+        print("{:>6} samples: snakemake -n in {:.2f}s (median of {}, max {:.2f}s)".format(
+            samples, median, args.repeat, max(timings)))
+    if args.output:
+        with open(args.output, "w", newline="") as outtsv:
+            writer = csv.writer(outtsv, delimiter="\t", lineterminator="\n")
+            writer.writerow(["step", "samples", "median_s", "max_s"])
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
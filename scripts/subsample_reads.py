@@ -0,0 +1,214 @@
+"""Subsample reads down to a target coverage of the genome.
+
+The reads are streamed once, and memory only grows with the number of
+selected reads. Every read (or read pair) gets a random key from a generator
+seeded with ``--seed``. The reads with the highest keys are kept until they add
+up to ``coverage * genome_size`` bases, so the same input and seed always give
+the same subset. Which reads make it is only known at the end, so every read
+that enters the selection is also spilled to a scratch file next to the output;
+the subset is then copied out of that file, not out of the input.
+
+- ``--mode long`` (long reads): the key is weighted by the read length
+  (Efraimidis-Spirakis), so longer reads are more likely to be kept.
+- ``--mode pairs`` (Illumina): the two files are read in lockstep and every pair
+  is kept or dropped as a whole, with a uniform key.
+
+The reads are written in the order of the input, in the input format (FASTA
+or FASTQ, gzipped or not). Subsets are stored in the content cache
+(content_cache.py), keyed by the path, size and modification time of the reads
+and the parameters (the reads are not hashed, that would be another pass over
+them), so every assembler and every run asking for the same subset shares it.
+
+Usage:
+    python scripts/subsample_reads.py --coverage 30 --genome-size 30m --mode long <reads.fq> --output <subset.fq>
+    python scripts/subsample_reads.py --coverage 50 --genome-size 30m --mode pairs <r1.fq> <r2.fq> --output <s1.fq> <s2.fq>
+"""
+import argparse
+import gzip
+import heapq
+import math
+import os
+import random
+import shutil
+import tempfile
+
+from content_cache import ContentCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+from resource_model import parse_genome_size
+
+# bump when the selection changes, so older subsets in the cache are not reused
+SELECTION_VERSION = 2
+
+
+def open_reads(path, mode="rt"):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def subset_suffix(path):
+    """Extension of the (uncompressed) subset of ``path``, e.g. 'fastq' for reads.fastq.gz or reads.pass.fastq."""
+    name = os.path.basename(str(path))
+    if name.endswith(".gz"):
+        name = name[:-len(".gz")]
+    return name.rsplit(".", 1)[1] if "." in name else "fastq"
+
+
+def source_signature(path):
+    """(path, size, mtime) of a reads file, the cache key of its subsets."""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def read_records(handle):
+    """Yield (record text, sequence length) of a FASTA or FASTQ file."""
+    first = handle.readline()
+    if not first:
+        return
+    if first.startswith("@"):
+        line = first
+        while line:
+            seq = handle.readline()
+            plus = handle.readline()
+            qual = handle.readline()
+            yield line + seq + plus + qual, len(seq.rstrip("\r\n"))
+            line = handle.readline()
+    elif first.startswith(">"):
+        header, lines, length = first, [], 0
+        for line in handle:
+            if line.startswith(">"):
+                yield header + "".join(lines), length
+                header, lines, length = line, [], 0
+            else:
+                lines.append(line)
+                length += len(line.rstrip("\r\n"))
+        yield header + "".join(lines), length
+    else:
+        raise ValueError("{} is neither FASTA nor FASTQ".format(getattr(handle, "name", "input")))
+
+
+def read_units(paths):
+    """Yield (records, bases) per read, or per pair when two files are given."""
+    handles = [open_reads(path) for path in paths]
+    try:
+        iterators = [read_records(handle) for handle in handles]
+        while True:
+            records = [next(iterator, None) for iterator in iterators]
+            if all(record is None for record in records):
+                return
+            if any(record is None for record in records):
+                raise ValueError("{} do not have the same number of reads".format(" and ".join(paths)))
+            yield [text for text, _ in records], sum(length for _, length in records)
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def select_reads(units, target_bases, seed, weighted, keep=None):
+    """Indexes of the reads kept out of ``units`` ((records, bases) per read, in input order).
+
+    ``keep(index, records)`` is called for every read that enters the selection.
+    """
+    rng = random.Random(seed)
+    heap, total = [], 0
+    for index, (records, length) in enumerate(units):
+        u = rng.random()
+        if length <= 0:
+            continue
+        # log(u) / w orders the reads like u ** (1 / w) without underflowing
+        key = math.log(u or 1e-300) / (length if weighted else 1)
+        if heap and total >= target_bases and key <= heap[0][0]:
+            continue
+        if keep is not None:
+            keep(index, records)
+        heapq.heappush(heap, (key, index, length))
+        total += length
+        while heap and total - heap[0][2] >= target_bases:
+            total -= heapq.heappop(heap)[2]
+    return set(index for _, index, _ in heap), total
+
+
+def read_spill(spill):
+    """Yield (index, record text) of a scratch file written by ``subsample``."""
+    for header in iter(spill.readline, b""):
+        index, size = header.split(b"\t")
+        yield int(index), spill.read(int(size)).decode()
+
+
+def subsample(paths, outputs, target_bases, seed=11, weighted=True):
+    """Write the subset of ``paths`` into ``outputs``, returns (reads kept, bases kept)."""
+    spill_dir = tempfile.mkdtemp(prefix=".subsample_", dir=os.path.dirname(os.path.abspath(outputs[0])))
+    spills = [open(os.path.join(spill_dir, "candidates_{}".format(number)), "w+b") for number in range(len(paths))]
+
+    def keep(index, records):
+        for spill, record in zip(spills, records):
+            data = record.encode()
+            spill.write("{}\t{}\n".format(index, len(data)).encode())
+            spill.write(data)
+
+    try:
+        selected, bases = select_reads(read_units(paths), target_bases, seed, weighted, keep)
+        for spill, output in zip(spills, outputs):
+            spill.seek(0)
+            with open_reads(output, "wt") as outreads:
+                for index, record in read_spill(spill):
+                    if index in selected:
+                        outreads.write(record)
+    finally:
+        for spill in spills:
+            spill.close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return len(selected), bases
+
+
+def cached_subsample(cache, paths, outputs, target_bases, seed=11, weighted=True):
+    key = cache.make_key("subsample", SELECTION_VERSION, target_bases, seed, weighted,
+                         *[value for path in paths for value in source_signature(path)])
+    names = ["reads_{}{}".format(number, ".gz" if output.endswith(".gz") else "")
+             for number, output in enumerate(outputs)]
+
+    def build(tmpdir):
+        subsample(paths, [os.path.join(tmpdir, name) for name in names], target_bases, seed, weighted)
+
+    def use(entry):
+        for name, output in zip(names, outputs):
+            cache.export(os.path.join(entry, name), [""], output)
+
+    cache.get_or_build(key, build, use, {"tool": "subsample_reads", "target_bases": target_bases, "seed": seed,
+                                         "weighted": weighted, "source": [os.path.abspath(path) for path in paths]})
+    return key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-size", default=DEFAULT_MAX_SIZE)
+    parser.add_argument("--no-cache", dest="cache", action="store_false")
+    parser.add_argument("--coverage", type=float, required=True)
+    parser.add_argument("--genome-size", required=True, help="e.g. 30m")
+    parser.add_argument("--mode", choices=["long", "pairs"], default="long")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("reads", nargs="+")
+    parser.add_argument("--output", nargs="+", required=True)
+    args = parser.parse_args()
+    if len(args.reads) != len(args.output):
+        parser.error("give one output per reads file")
+    if args.mode == "pairs" and len(args.reads) != 2:
+        parser.error("--mode pairs needs the two files of the pairs")
+
+    target_bases = int(args.coverage * parse_genome_size(args.genome_size))
+    weighted = args.mode == "long"
+    for output in args.output:
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+    if args.cache:
+        key = cached_subsample(ContentCache(args.cache_dir, args.max_size), args.reads, args.output,
+                               target_bases, args.seed, weighted)
+        print("Subset of {} at {}x available in {} (cache entry {})".format(
+            " ".join(args.reads), args.coverage, " ".join(args.output), key))
+    else:
+        kept, bases = subsample(args.reads, args.output, target_bases, args.seed, weighted)
+        print("Kept {} reads ({} bases) of {}".format(kept, bases, " ".join(args.reads)))
+
+
+if __name__ == "__main__":
+    main()
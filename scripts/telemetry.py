@@ -0,0 +1,431 @@
+"""Resource telemetry of a workflow run, exported as a Chrome trace timeline.
+
+``monitor`` runs next to snakemake (started by the ``onstart`` handler) and
+samples ``/proc`` every ``--interval`` seconds. Every direct child of the
+snakemake process is one job: the shell of a rule, or one ``shell()`` call of
+a ``run:`` block. The CPU time, RSS and disk I/O of the whole process tree of
+each job are summed, and the running containers are sampled with
+``docker stats`` (their processes are not children of snakemake). Samples are
+appended to ``samples.jsonl`` in the telemetry directory.
+
+``Span`` times the steps of a ``run:`` block. It appends the name, start and
+end of the step to ``spans.jsonl``, so the cost of every subcommand of a
+multi-command rule shows in the timeline.
+
+``trace`` writes a Chrome trace (chrome://tracing or https://ui.perfetto.dev).
+Jobs are drawn on lanes, one lane per concurrently running job, with counters
+for the busy and idle cores, the memory and the I/O of the workflow. It also
+prints the wall time, the average number of busy cores and the time spent
+with a single job running, which is where the run is serialized.
+
+The monitor only sees the jobs run on this machine. Cluster jobs are sampled
+on their node instead: ``start_monitor`` exports the telemetry directory and
+interval in the environment of snakemake, and the submit command of the
+cluster profiles (``profiles/cluster/submit.py``) then wraps every submission
+in its own monitor, writing to ``jobs/<submission>/samples.jsonl``. The
+submissions get their own lanes in the timeline; the core, memory and I/O
+counters stay those of this machine.
+
+Usage:
+    python scripts/telemetry.py monitor <dir> --pid <snakemake pid> [--interval 5] [--cores N] [--no-containers] [--label <name>]
+    python scripts/telemetry.py stop <dir>
+    python scripts/telemetry.py trace <dir> <trace.json>
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 5
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MB = 1024 ** 2
+DOCKER_UNITS = {"b": 1, "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3, "tb": 1000 ** 4,
+                "kib": 1024, "mib": 1024 ** 2, "gib": 1024 ** 3, "tib": 1024 ** 4}
+# prefix the snakemake shell() puts in front of every command
+SHELL_PREFIX = "set -euo pipefail;"
+# set by start_monitor for the cluster submit command, which samples every submission on its node
+DIR_ENV = "SNAKEMAKE_PIPELINES_TELEMETRY_DIR"
+INTERVAL_ENV = "SNAKEMAKE_PIPELINES_TELEMETRY_INTERVAL"
+# per-submission samples of the cluster jobs, in the telemetry directory
+JOBS_DIR = "jobs"
+
+
+def read_process(pid):
+    """Dict with the parent, start time, CPU seconds, RSS and I/O of ``pid``, None once it exited."""
+    try:
+        with open("/proc/{}/stat".format(pid)) as instat:
+            stat = instat.read()
+        with open("/proc/{}/cmdline".format(pid), "rb") as incmdline:
+            cmdline = [arg.decode(errors="replace") for arg in incmdline.read().split(b"\0") if arg]
+    except (OSError, IOError):
+        return None
+    # the command name in parentheses may contain spaces
+    fields = stat[stat.rfind(")") + 2:].split()
+    process = {
+        "ppid": int(fields[1]),
+        "start": int(fields[19]),
+        # exited children that were waited for are counted in cutime/cstime of their parent
+        "cpu_s": sum(int(value) for value in fields[11:15]) / CLOCK_TICKS,
+        "rss_mb": int(fields[21]) * PAGE_SIZE / MB,
+        "read_mb": 0.0,
+        "write_mb": 0.0,
+        "cmdline": cmdline,
+    }
+    try:
+        with open("/proc/{}/io".format(pid)) as inio:
+            for line in inio:
+                key, value = line.split(":")
+                if key == "read_bytes":
+                    process["read_mb"] = int(value) / MB
+                elif key == "write_bytes":
+                    process["write_mb"] = int(value) / MB
+    except (OSError, IOError, ValueError):
+        pass
+    return process
+
+
+def job_command(cmdline):
+    """Readable command of a job out of its argv (the command of ``bash -c`` without the snakemake prefix)."""
+    if len(cmdline) >= 3 and os.path.basename(cmdline[0]) in ("bash", "sh") and cmdline[1] == "-c":
+        command = cmdline[2].strip()
+    else:
+        command = " ".join(cmdline)
+    if command.startswith(SHELL_PREFIX):
+        command = command[len(SHELL_PREFIX):].strip()
+    return " ".join(command.split())
+
+
+def sample_jobs(root_pid, exclude=()):
+    """Totals of the process tree of every direct child of ``root_pid`` but the ones in ``exclude``."""
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            process = read_process(int(entry))
+            if process is not None:
+                processes[int(entry)] = process
+    children = {}
+    for pid, process in processes.items():
+        children.setdefault(process["ppid"], []).append(pid)
+
+    jobs = []
+    for job_pid in children.get(root_pid, []):
+        if job_pid in exclude:
+            continue
+        job = processes[job_pid]
+        totals = {"cpu_s": 0.0, "rss_mb": 0.0, "read_mb": 0.0, "write_mb": 0.0}
+        stack, procs = [job_pid], 0
+        while stack:
+            pid = stack.pop()
+            procs += 1
+            for key in totals:
+                totals[key] += processes[pid][key]
+            stack.extend(children.get(pid, []))
+        totals.update({key: round(value, 2) for key, value in totals.items()})
+        totals.update(id="{}-{}".format(job_pid, job["start"]), pid=job_pid, procs=procs,
+                      cmd=job_command(job["cmdline"]))
+        jobs.append(totals)
+    return jobs
+
+
+def docker_bytes(value):
+    value = value.strip().lower()
+    number = value.rstrip("abcdefghijklmnopqrstuvwxyz")
+    return float(number) * DOCKER_UNITS.get(value[len(number):].strip(), 1)
+
+
+def sample_containers():
+    """CPU and memory of the running docker containers, [] without docker."""
+    if shutil.which("docker") is None:
+        return []
+    try:
+        out = subprocess.run(["docker", "stats", "--no-stream", "--format", "{{.Name}}\t{{.CPUPerc}}\t{{.MemUsage}}"],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True,
+                             timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    containers = []
+    for line in out.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 3:
+            continue
+        try:
+            containers.append({"name": fields[0], "cpu_pct": float(fields[1].rstrip("%")),
+                               "mem_mb": round(docker_bytes(fields[2].split("/")[0]) / MB, 2)})
+        except ValueError:
+            continue
+    return containers
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def monitor(telemetry_dir, root_pid, interval=DEFAULT_INTERVAL, cores=None, containers=True, label=None):
+    """Sample the jobs of ``root_pid`` until it exits or the monitor is stopped; ``label`` names all of them."""
+    os.makedirs(telemetry_dir, exist_ok=True)
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+    with open(os.path.join(telemetry_dir, "monitor.pid"), "w") as outpid:
+        outpid.write("{}\n".format(os.getpid()))
+    with open(os.path.join(telemetry_dir, "samples.jsonl"), "a") as outsamples:
+        outsamples.write(json.dumps({"t": time.time(), "start": True, "root_pid": root_pid,
+                                     "cores": cores or os.cpu_count(), "interval": interval}) + "\n")
+        while not stopped and pid_alive(root_pid):
+            started = time.time()
+            sample = {"t": started, "jobs": sample_jobs(root_pid, exclude=(os.getpid(),))}
+            if label:
+                for job in sample["jobs"]:
+                    job["cmd"] = label
+            if containers:
+                sample["containers"] = sample_containers()
+            outsamples.write(json.dumps(sample) + "\n")
+            outsamples.flush()
+            # sleep in short steps so a stop request does not wait for a whole interval
+            while not stopped and time.time() - started < interval:
+                time.sleep(min(0.2, interval))
+    try:
+        os.remove(os.path.join(telemetry_dir, "monitor.pid"))
+    except OSError:
+        pass
+
+
+def start_monitor(telemetry_dir, root_pid, interval=DEFAULT_INTERVAL, cores=None, containers=True):
+    """Start ``monitor`` in the background, detached from the terminal of snakemake."""
+    os.makedirs(telemetry_dir, exist_ok=True)
+    os.environ[DIR_ENV] = os.path.abspath(telemetry_dir)
+    os.environ[INTERVAL_ENV] = str(interval)
+    command = [sys.executable, os.path.abspath(__file__), "monitor", telemetry_dir, "--pid", str(root_pid),
+               "--interval", str(interval)]
+    if cores:
+        command += ["--cores", str(cores)]
+    if not containers:
+        command.append("--no-containers")
+    with open(os.path.join(telemetry_dir, "monitor.log"), "a") as log:
+        return subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                start_new_session=True).pid
+
+
+def stop_monitor(telemetry_dir, timeout=30):
+    """Stop the monitor of ``telemetry_dir`` and wait until it wrote its last sample."""
+    pid_path = os.path.join(telemetry_dir, "monitor.pid")
+    try:
+        with open(pid_path) as inpid:
+            pid = int(inpid.read())
+    except (OSError, ValueError):
+        return False
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return False
+    deadline = time.time() + timeout
+    while os.path.exists(pid_path) and pid_alive(pid) and time.time() < deadline:
+        time.sleep(0.1)
+    return True
+
+
+class Span(object):
+    """Times a step of a ``run:`` block into spans.jsonl; does nothing when ``telemetry_dir`` is None.
+
+        with telemetry.Span(TELEMETRY_DIR, "blobtools create", rule="contamination_check", sample=wildcards.sample):
+            shell("blobtools create ...")
+    """
+
+    def __init__(self, telemetry_dir, name, **args):
+        self.telemetry_dir = telemetry_dir
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.telemetry_dir is None:
+            return False
+        os.makedirs(self.telemetry_dir, exist_ok=True)
+        record = {"name": self.name, "start": self.start, "end": time.time(), "pid": os.getpid(),
+                  "tid": threading.get_ident(), "ok": exc_type is None, "args": self.args}
+        # one write per record, appends of the concurrent jobs do not interleave
+        with open(os.path.join(self.telemetry_dir, "spans.jsonl"), "a") as outspans:
+            outspans.write(json.dumps(record) + "\n")
+        return False
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as injsonl:
+        return [json.loads(line) for line in injsonl if line.strip()]
+
+
+def assign_lanes(intervals):
+    """Lane of every (key, start, end), reusing the lowest lane that is free at the start."""
+    lanes, free_at = {}, []
+    for key, start, end in sorted(intervals, key=lambda interval: interval[1]):
+        for lane, busy_until in enumerate(free_at):
+            if busy_until <= start:
+                break
+        else:
+            lane = len(free_at)
+            free_at.append(0)
+        free_at[lane] = end
+        lanes[key] = lane
+    return lanes
+
+
+def build_trace(telemetry_dir):
+    """(Chrome trace dict, summary dict) of the samples and spans of ``telemetry_dir``."""
+    records = read_jsonl(os.path.join(telemetry_dir, "samples.jsonl"))
+    header = next((record for record in reversed(records) if record.get("start")), {})
+    samples = [record for record in records if "jobs" in record and record["t"] >= header.get("t", 0)]
+    # the jobs of every cluster submission, with ids that cannot clash across nodes
+    job_samples = list(samples)
+    jobs_dir = os.path.join(telemetry_dir, JOBS_DIR)
+    for submission in sorted(os.listdir(jobs_dir)) if os.path.isdir(jobs_dir) else []:
+        for record in read_jsonl(os.path.join(jobs_dir, submission, "samples.jsonl")):
+            if "jobs" in record and record["t"] >= header.get("t", 0):
+                for job in record["jobs"]:
+                    job["id"] = "{}-{}".format(submission, job["id"])
+                job_samples.append(record)
+    job_samples.sort(key=lambda record: record["t"])
+    spans = read_jsonl(os.path.join(telemetry_dir, "spans.jsonl"))
+    spans = [span for span in spans if span["end"] >= header.get("t", 0)]
+    cores = header.get("cores") or os.cpu_count()
+    interval = header.get("interval", DEFAULT_INTERVAL)
+    origin = min([sample["t"] for sample in job_samples] + [span["start"] for span in spans] or [time.time()])
+
+    def us(seconds):
+        return int(round((seconds - origin) * 1e6))
+
+    # every job lasts from the first to the last sample that saw it, plus half an interval on both sides
+    jobs = {}
+    for sample in job_samples:
+        for job in sample["jobs"]:
+            seen = jobs.setdefault(job["id"], {"cmd": job["cmd"], "first": sample["t"], "last": sample["t"],
+                                               "cpu_s": 0.0, "rss_mb": 0.0, "read_mb": 0.0, "write_mb": 0.0})
+            seen["last"] = sample["t"]
+            seen["rss_mb"] = max(seen["rss_mb"], job["rss_mb"])
+            for key in ("cpu_s", "read_mb", "write_mb"):
+                seen[key] = max(seen[key], job[key])
+    for job in jobs.values():
+        job["start"] = max(origin, job["first"] - interval / 2.0)
+        job["end"] = job["last"] + interval / 2.0
+
+    events = [{"ph": "M", "pid": 1, "name": "process_name", "args": {"name": "workflow"}},
+              {"ph": "M", "pid": 2, "name": "process_name", "args": {"name": "jobs"}},
+              {"ph": "M", "pid": 3, "name": "process_name", "args": {"name": "run block steps"}},
+              {"ph": "M", "pid": 4, "name": "process_name", "args": {"name": "containers"}}]
+    lanes = assign_lanes([(job_id, job["start"], job["end"]) for job_id, job in jobs.items()])
+    for lane in sorted(set(lanes.values())):
+        events.append({"ph": "M", "pid": 2, "tid": lane, "name": "thread_name", "args": {"name": "slot {}".format(lane)}})
+    for job_id, job in jobs.items():
+        duration = job["end"] - job["start"]
+        events.append({"ph": "X", "pid": 2, "tid": lanes[job_id], "name": job["cmd"][:80] or job_id,
+                       "ts": us(job["start"]), "dur": int(duration * 1e6),
+                       "args": {"command": job["cmd"], "cpu_s": job["cpu_s"], "max_rss_mb": job["rss_mb"],
+                                "read_mb": job["read_mb"], "write_mb": job["write_mb"],
+                                "avg_cores": round(job["cpu_s"] / duration, 2) if duration else None}})
+
+    span_lanes = {}
+    for span in spans:
+        lane = span_lanes.setdefault((span["pid"], span["tid"]), len(span_lanes))
+        events.append({"ph": "X", "pid": 3, "tid": lane, "name": span["name"], "ts": us(span["start"]),
+                       "dur": int((span["end"] - span["start"]) * 1e6), "args": dict(span["args"], ok=span["ok"])})
+
+    # counters from the CPU time and I/O gained between two samples
+    previous, busy_time, serial_time, wall = {}, 0.0, 0.0, 0.0
+    for before, sample in zip([None] + samples[:-1], samples):
+        current = {job["id"]: job for job in sample["jobs"]}
+        elapsed = sample["t"] - before["t"] if before else 0
+        cpu = read = write = 0.0
+        for job_id, job in current.items():
+            last = previous.get(job_id, {"cpu_s": 0.0, "read_mb": 0.0, "write_mb": 0.0})
+            cpu += max(0.0, job["cpu_s"] - last["cpu_s"])
+            read += max(0.0, job["read_mb"] - last["read_mb"])
+            write += max(0.0, job["write_mb"] - last["write_mb"])
+        busy = cpu / elapsed if elapsed else 0.0
+        if elapsed:
+            wall += elapsed
+            busy_time += cpu
+            if len(current) == 1:
+                serial_time += elapsed
+        ts = us(sample["t"])
+        events.append({"ph": "C", "pid": 1, "name": "cores", "ts": ts,
+                       "args": {"busy": round(busy, 2), "idle": round(max(0.0, cores - busy), 2)}})
+        events.append({"ph": "C", "pid": 1, "name": "jobs", "ts": ts, "args": {"running": len(current)}})
+        events.append({"ph": "C", "pid": 1, "name": "rss MB", "ts": ts,
+                       "args": {"jobs": round(sum(job["rss_mb"] for job in current.values()), 1)}})
+        events.append({"ph": "C", "pid": 1, "name": "io MB/s", "ts": ts,
+                       "args": {"read": round(read / elapsed, 2) if elapsed else 0.0,
+                                "write": round(write / elapsed, 2) if elapsed else 0.0}})
+        for container in sample.get("containers", []):
+            events.append({"ph": "C", "pid": 4, "name": container["name"], "ts": ts,
+                           "args": {"cpu_pct": container["cpu_pct"], "mem_mb": container["mem_mb"]}})
+        previous = current
+
+    summary = {
+        "wall_s": round(wall, 1),
+        "cores": cores,
+        "jobs": len(jobs),
+        "avg_busy_cores": round(busy_time / wall, 2) if wall else 0.0,
+        "single_job_s": round(serial_time, 1),
+        "longest_jobs": [{"command": job["cmd"], "seconds": round(job["end"] - job["start"], 1)}
+                         for job in sorted(jobs.values(), key=lambda job: job["end"] - job["start"], reverse=True)[:5]],
+    }
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": summary}, summary
+
+
+def write_trace(telemetry_dir, output):
+    trace, summary = build_trace(telemetry_dir)
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as outtrace:
+        json.dump(trace, outtrace)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    monitor_parser = subparsers.add_parser("monitor", help="sample the jobs of a snakemake process")
+    monitor_parser.add_argument("dir")
+    monitor_parser.add_argument("--pid", type=int, required=True, help="pid of the snakemake process")
+    monitor_parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between samples")
+    monitor_parser.add_argument("--cores", type=int, help="cores available to the workflow (default: all)")
+    monitor_parser.add_argument("--no-containers", dest="containers", action="store_false")
+    monitor_parser.add_argument("--label", help="name of the jobs in the timeline (default: their command)")
+    stop = subparsers.add_parser("stop", help="stop the monitor")
+    stop.add_argument("dir")
+    trace = subparsers.add_parser("trace", help="write the Chrome trace of the samples")
+    trace.add_argument("dir")
+    trace.add_argument("output")
+    args = parser.parse_args()
+    if args.command == "monitor":
+        monitor(args.dir, args.pid, args.interval, args.cores, args.containers, args.label)
+    elif args.command == "stop":
+        stop_monitor(args.dir)
+    elif args.command == "trace":
+        summary = write_trace(args.dir, args.output)
+        print("{jobs} jobs in {wall_s}s, {avg_busy_cores} of {cores} cores busy on average, "
+              "{single_job_s}s with a single job running".format(**summary))
+        for job in summary["longest_jobs"]:
+            print("{:>10.1f}s  {}".format(job["seconds"], job["command"][:100]))
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()
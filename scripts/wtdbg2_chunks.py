@@ -0,0 +1,145 @@
+"""Split a wtdbg2 layout into balanced chunks for consensus and merge the contigs back.
+
+``split`` streams ``<prefix>.ctg.lay.gz`` twice and never holds more than one
+line of it. The first pass measures every contig block (its ``>`` line and
+the ``E``/``S`` lines after it). The contigs are then assigned whole, largest
+first, to the chunk with the fewest bytes, since the consensus time follows the
+amount of read sequence of a contig. The second pass writes every block to its
+chunk, ``chunk_<i>.lay.gz``, keeping the original order inside each chunk.
+``order.tsv`` lists the contigs in the original order with their chunk.
+
+``merge`` indexes the consensus of every chunk (``wtpoa-cns -i chunk_<i>.lay.gz``)
+and copies the contigs to ``ctg.fa`` in the order of the layout, as a single
+``wtpoa-cns`` run would write them. Contigs without consensus are skipped.
+
+Usage:
+    python scripts/wtdbg2_chunks.py split <prefix.ctg.lay.gz> <out_dir> --chunks N
+    python scripts/wtdbg2_chunks.py merge <out_dir>/order.tsv <ctg.fa> <chunk_0.ctg.fa> [...]
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import os
+
+# the chunks are read once by wtpoa-cns, fast compression is enough
+COMPRESS_LEVEL = 1
+
+
+def open_layout(path, mode="rb"):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode, compresslevel=COMPRESS_LEVEL) if "w" in mode else gzip.open(path, mode)
+    return open(path, mode)
+
+
+def contig_sizes(layout):
+    """List of (contig name, bytes of its block) in the order of ``layout``."""
+    sizes = []
+    with open_layout(layout) as inlayout:
+        for line in inlayout:
+            if line.startswith(b">"):
+                sizes.append([line[1:].split()[0].decode(), 0])
+            if sizes:
+                sizes[-1][1] += len(line)
+    return [tuple(size) for size in sizes]
+
+
+def assign_chunks(sizes, chunks):
+    """Chunk index of every contig, largest contigs first into the chunk with the fewest bytes."""
+    heap = [(0, chunk) for chunk in range(chunks)]
+    assignment = {}
+    for name, size in sorted(sizes, key=lambda contig: contig[1], reverse=True):
+        load, chunk = heapq.heappop(heap)
+        assignment[name] = chunk
+        heapq.heappush(heap, (load + size, chunk))
+    return assignment
+
+
+def split_layout(layout, out_dir, chunks):
+    """Write chunk_0.lay.gz ... chunk_<N-1>.lay.gz and order.tsv into ``out_dir``, returns the number of contigs."""
+    sizes = contig_sizes(layout)
+    assignment = assign_chunks(sizes, chunks)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "order.tsv"), "w", newline="") as outorder:
+        writer = csv.writer(outorder, delimiter="\t", lineterminator="\n")
+        writer.writerows((name, assignment[name]) for name, _ in sizes)
+
+    handles = [open_layout(os.path.join(out_dir, "chunk_{}.lay.gz".format(chunk)), "wb") for chunk in range(chunks)]
+    try:
+        with open_layout(layout) as inlayout:
+            handle = None
+            for line in inlayout:
+                if line.startswith(b">"):
+                    handle = handles[assignment[line[1:].split()[0].decode()]]
+                if handle is not None:
+                    handle.write(line)
+    finally:
+        for handle in handles:
+            handle.close()
+    return len(sizes)
+
+
+def index_fasta(path):
+    """{contig name: (start, end)} byte ranges of the records of ``path``."""
+    index, name, start, offset = {}, None, 0, 0
+    with open(path, "rb") as infasta:
+        for line in infasta:
+            if line.startswith(b">"):
+                if name is not None:
+                    index[name] = (start, offset)
+                name, start = line[1:].split()[0].decode(), offset
+            offset += len(line)
+    if name is not None:
+        index[name] = (start, offset)
+    return index
+
+
+def merge_consensus(order_path, output, chunk_fastas):
+    """Copy the contigs of ``chunk_fastas`` (in chunk order) to ``output`` in layout order, returns how many."""
+    with open(order_path, newline="") as inorder:
+        order = [(name, int(chunk)) for name, chunk in csv.reader(inorder, delimiter="\t")]
+    indexes = [index_fasta(path) for path in chunk_fastas]
+    handles = [open(path, "rb") for path in chunk_fastas]
+    written = 0
+    try:
+        with open(output, "wb") as outfasta:
+            for name, chunk in order:
+                if name not in indexes[chunk]:
+                    continue
+                start, end = indexes[chunk][name]
+                handles[chunk].seek(start)
+                remaining = end - start
+                while remaining:
+                    block = handles[chunk].read(min(remaining, 1024 * 1024))
+                    outfasta.write(block)
+                    remaining -= len(block)
+                written += 1
+    finally:
+        for handle in handles:
+            handle.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    split = subparsers.add_parser("split", help="split the layout into balanced chunks")
+    split.add_argument("layout")
+    split.add_argument("out_dir")
+    split.add_argument("--chunks", type=int, default=1)
+    merge = subparsers.add_parser("merge", help="merge the consensus of the chunks in layout order")
+    merge.add_argument("order")
+    merge.add_argument("output")
+    merge.add_argument("chunks", nargs="+", help="consensus of every chunk, in chunk order")
+    args = parser.parse_args()
+    if args.command == "split":
+        contigs = split_layout(args.layout, args.out_dir, args.chunks)
+        print("{} contigs of {} in {} chunks".format(contigs, args.layout, args.chunks))
+    elif args.command == "merge":
+        merge_consensus(args.order, args.output, args.chunks)
+    else:
+        parser.error("missing command")
+
+
+if __name__ == "__main__":
+    main()